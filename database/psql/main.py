@@ -1,13 +1,122 @@
 """
 *   PSQL wrapper for the database.
 """
-import psycopg2
+import contextlib, threading, time
+import psycopg2, psycopg2.extras, psycopg2.pool
 
 
 # Global Variables
-CONNECTION = None
+POOL          = None  # psycopg2.pool.ThreadedConnectionPool, set by initialize_db().
+POOL_SIZE     = 8     # Connections open at most. The scrapers run concurrently, each checks one out per call.
+SLOTS         = threading.BoundedSemaphore( POOL_SIZE ) # Callers wait for a free connection instead of failing.
+HEALTH_CHECK  = 30    # Seconds a connection may sit idle before it is pinged on checkout.
+RETRIES       = 5     # Attempts to (re)connect before giving up.
+BACKOFF       = 1.0   # Seconds before the second attempt, doubling on every failure.
 
+IDLE_SINCE    : dict[int, float] = {} # id(connection) -> time.monotonic() it was returned to the pool.
 
+
+#
+#   Connection handling
+#
+@contextlib.contextmanager
+def connection():
+    """
+    Checks out a healthy connection from the pool, and returns it afterwards.
+    Uncommitted work is rolled back, and broken connections are discarded so
+    that the next checkout reconnects.
+
+    Usage:
+        with connection() as conn:
+            ...
+    """
+    with SLOTS:
+        conn = _checkout()
+        try:
+            yield conn
+
+        except ( psycopg2.OperationalError, psycopg2.InterfaceError ):
+            _discard( conn )
+            conn = None
+            raise
+
+        finally:
+            if conn is not None:
+                _checkin( conn )
+
+
+@contextlib.contextmanager
+def cursor():
+    """
+    Cursor on a pooled connection, always closed afterwards.
+
+    Usage:
+        with cursor() as (conn, cur):
+            cur.execute( ... )
+            conn.commit()
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            yield conn, cur
+
+
+def _checkout():
+    delay = BACKOFF
+    for attempt in range( 1, RETRIES + 1 ):
+        try:
+            # Dropped by the server, try the next one. After a restart all the idle
+            # ones are, until the pool runs out of them and opens a new connection.
+            conn = POOL.getconn()
+            while id( conn ) in IDLE_SINCE and not _healthy( conn ):
+                _discard( conn )
+                conn = POOL.getconn()
+
+            return conn
+
+        except psycopg2.OperationalError as e:
+            if attempt == RETRIES:
+                raise
+
+            print( f"[PSQL][!] Could not connect to the database ({ e }), retrying in { delay :.0f}s." )
+            time.sleep( delay )
+            delay *= 2
+
+
+def _healthy( conn ) -> bool:
+    if conn.closed:
+        return False
+
+    # Recently used, no need for a round trip.
+    if time.monotonic() - IDLE_SINCE.get( id(conn), 0 ) < HEALTH_CHECK:
+        return True
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute( "SELECT 1;" )
+        conn.rollback()
+        return True
+
+    except ( psycopg2.OperationalError, psycopg2.InterfaceError ):
+        return False
+
+
+def _checkin( conn ):
+    # Never hand out a connection in the middle of a transaction.
+    if not conn.closed:
+        conn.rollback()
+
+    IDLE_SINCE[ id(conn) ] = time.monotonic()
+    POOL.putconn( conn, close = bool( conn.closed ) )
+
+
+def _discard( conn ):
+    IDLE_SINCE.pop( id(conn), None )
+    POOL.putconn( conn, close = True )
+
+
+#
+#   Interface
+#
 def get_tables() -> list:
     """
     Check for the tables present in the SQLite instance
@@ -15,12 +124,10 @@ def get_tables() -> list:
     Returns:
         list : The tables in the SQLite instance.
     """
-    global CONNECTION
+    with cursor() as (conn, cur):
+        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
 
-    cursor = CONNECTION.cursor()
-    cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
-    
-    tables = cursor.fetchall()    
+        tables = cur.fetchall()
 
     return tables
 
@@ -28,40 +135,64 @@ def get_tables() -> list:
 def create_tables( tables ) -> bool:
     """
     Creates new tables according to the queries given in `tables` arg.
-        
+
     Args:
         tables : dict - Dictionary where the key is the table name and the value is the CREATE query.
-    
+
     Returns:
-        bool : True upon success  
+        bool : True upon success
     """
-    
-    global CONNECTION
-    
-    cursor = CONNECTION.cursor()
-    
+
     try:
-        for table_name in tables:
-            
-            # Check if table exists already in the database.
-            table_in_database_query = query_database( f"SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name = '{ table_name.lower() }';" )
-            table_in_database_result = len( table_in_database_query )
-            if table_in_database_result == 1:
-                print( "[PSQL][+] Table exists: ", table_name )  
-                continue    
-            
-            # Create a new table
-            cursor.execute( tables[table_name] )
-            print( "[PSQL][+] Table: ", table_name, "created" )           
-
-        # Commit changes
-        CONNECTION.commit()
-        cursor.close()
+        with cursor() as (conn, cur):
+            for table_name in tables:
+
+                # Check if table exists already in the database.
+                cur.execute( "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name = %s;", ( table_name.lower(), ) )
+                table_in_database_result = len( cur.fetchall() )
+                if table_in_database_result == 1:
+                    print( "[PSQL][+] Table exists: ", table_name )
+                    continue
+
+                # Create a new table
+                cur.execute( tables[table_name] )
+                print( "[PSQL][+] Table: ", table_name, "created" )
+
+            # Commit changes
+            conn.commit()
 
     except Exception as e:
         print( "[PSQL][!] Error when creating tables,", e )
         return False
-    
+
+    return True
+
+
+def migrate_tables( migrations ) -> bool:
+    """
+    Brings existing tables up to date, as create_tables() leaves them as they are.
+    The queries must be idempotent, e.g. ADD COLUMN IF NOT EXISTS, as they run on every start.
+
+    Args:
+        migrations : dict - Dictionary where the key is the table name and the value is the ALTER query.
+
+    Returns:
+        bool : True upon success
+    """
+
+    try:
+        with cursor() as (conn, cur):
+            for table_name in migrations:
+                cur.execute( migrations[table_name] )
+                print( "[PSQL][+] Table: ", table_name, "migrated" )
+
+            # Commit changes
+            conn.commit()
+
+    except Exception as e:
+        print( "[PSQL][!] Error when migrating tables,", e )
+        return False
+
     return True
 
 
@@ -76,23 +207,18 @@ def query_database( query:str, user_input:tuple = None ) -> list:
     Returns:
         list : the results of the query.
     """
-    
-    global CONNECTION
-    rows   : list = []
-    cursor        = CONNECTION.cursor()
-    
+
     try:
-        # No user input, just a query
-        if not user_input:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return rows
-        
-        # If user input is given, use it in query
-        cursor.execute(query, user_input)
-        rows = cursor.fetchall()
-        return rows
-    
+        with cursor() as (conn, cur):
+            # No user input, just a query
+            if not user_input:
+                cur.execute(query)
+                return cur.fetchall()
+
+            # If user input is given, use it in query
+            cur.execute(query, user_input)
+            return cur.fetchall()
+
     except Exception as e:
         print( f"[PSQL][!] Ran into an issue while running execute({ query }). Details: ", e )
         return False
@@ -110,93 +236,143 @@ def insert_data( query:str, data ) -> bool:
         bool : True upon success
     """
 
-    global CONNECTION
+    try:
+        with cursor() as (conn, cur):
+            # If data is of type tuple, use execute
+            if type(data) == tuple:
+                cur.execute( query, data )
+                conn.commit()
 
+            # If data is of type list, use executemany
+            if type(data) == list:
+                cur.executemany( query, data )
+                conn.commit()
 
-    cursor = CONNECTION.cursor()
+            return cur.lastrowid
 
-    try:
-        # If data is of type tuple, use execute
-        if type(data) == tuple:
-            cursor.execute( query, data )
-            CONNECTION.commit()
-
-        # If data is of type list, use executemany
-        if type(data) == list:
-            cursor.executemany( query, data )
-            CONNECTION.commit()
-    
-        return cursor.lastrowid
-    
     except psycopg2.errors.UniqueViolation as UV:
-        CONNECTION.rollback()
         print( f"[PSQL][x] Tried to implant duplicate value to a constrainted column: ", UV )
         return 0
-    
+
     except Exception as e:
-        CONNECTION.rollback()
         print( f"[PSQL][!] Ran into an issue while running execute({ query }), with data {data}, details: ", e )
         return -1
-    
+
     return -1
 
 
+def insert_many( query:str, data:list, template:str = None ) -> list:
+    """
+    Insert many rows with one statement per page of rows (psycopg2's execute_values),
+    in a single transaction.
+
+    Args:
+        query    : str  - The insert query, with a single `VALUES %s`. May have a RETURNING clause.
+        data     : list - The rows being inserted, as tuples.
+        template : str  - Template of one row, e.g. "(%s, %s)". Optional.
+
+    Returns:
+        list : the rows returned by the query, if any. False upon failure.
+    """
+
+    if not data:
+        return []
+
+    try:
+        with cursor() as (conn, cur):
+            rows = psycopg2.extras.execute_values( cur, query, data, template, fetch = "RETURNING" in query.upper() )
+            conn.commit()
+            return rows or []
+
+    except Exception as e:
+        print( f"[PSQL][!] Ran into an issue while running execute_values({ query }), with { len(data) } rows, details: ", e )
+        return False
+
+
 def update_data( query:str, data ) -> tuple:
     """
     Update data in a table using premade queries.
 
     Args:
-        query : str   - The insert query for the data
-        data  : tuple - The data being inserted. 
+        query : str        - The insert query for the data
+        data  : tuple,list - The data being inserted. Either in format tuple or list, a list is updated in one transaction.
 
     Returns:
         bool : Upon success
     """
-    global CONNECTION
- 
-    
-    cursor = CONNECTION.cursor()
- 
+
     try:
-        # If data is not of type tuple, skip interaction.
-        if type(data) == tuple:
-            cursor.execute( query, data )
-            CONNECTION.commit()
+        with cursor() as (conn, cur):
+            # If data is of type tuple, use execute
+            if type(data) == tuple:
+                cur.execute( query, data )
+                conn.commit()
+
+            # If data is of type list, use executemany
+            if type(data) == list:
+                cur.executemany( query, data )
+                conn.commit()
+
+            rowcount = cur.rowcount
 
     except Exception as e:
-        CONNECTION.rollback()
         print( f"[PSQL][!] Ran into an issue while running execute({ query }), with data {data}, details: ", e )
         return False
-    
-    
-    print( f"[PSQL][?] Rows updated: { cursor.rowcount }" )
+
+
+    print( f"[PSQL][?] Rows updated: { rowcount }" )
     return True
 
 
+def update_returning( query:str, data:tuple ) -> list:
+    """
+    Update data in a table, and get the rows the query returns (e.g. UPDATE ... RETURNING).
+
+    Args:
+        query : str   - The update query, with a RETURNING clause.
+        data  : tuple - The data used in the query.
+
+    Returns:
+        list : the returned rows. False upon failure.
+    """
+
+    try:
+        with cursor() as (conn, cur):
+            cur.execute( query, data )
+            rows = cur.fetchall()
+            conn.commit()
+            return rows
+
+    except Exception as e:
+        print( f"[PSQL][!] Ran into an issue while running execute({ query }), with data {data}, details: ", e )
+        return False
+
+
 def initialize_db( tables, db_url ) -> bool:
     """
     Prepare the PSQL Database for use.
 
     Args:
-        tables  : dict - Dictionary where the key is the table name and the value is the CREATE query. 
+        tables  : dict - Dictionary where the key is the table name and the value is the CREATE query.
         db_name : str  - Name of the SQLite database file.
 
-    Returns 
+    Returns
         bool : Boolean upon success.
     """
-    global CONNECTION
+    global POOL
 
     print( "[PSQL][>] Connecting to database...")
-    try:        
+    try:
 
-        # Make connection
-        CONNECTION = psycopg2.connect(db_url)
+        # Make the pool. Connections are reopened when dropped. The pool closes the
+        # connections returned past `minconn`, so all of them are kept for reuse.
+        POOL = psycopg2.pool.ThreadedConnectionPool( POOL_SIZE, POOL_SIZE, db_url )
         print( "[PSQL][>] Connection made." )
-            
+
         # Create/Check for the presence of the tables
         if not create_tables( tables ):
             return False
-        
+
         print( "[PSQL][>] Desired tables present." )
 
     except Exception as error:
@@ -204,4 +380,4 @@ def initialize_db( tables, db_url ) -> bool:
         return False
 
     print( "[PSQL][*] Database ready!" )
-    return True
\ No newline at end of file
+    return True
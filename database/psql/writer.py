@@ -0,0 +1,300 @@
+"""
+*   Write-behind queue: the scrapers hand their rows over, a background thread writes them.
+"""
+import atexit, json, os, queue, threading, time
+from datetime import datetime
+
+import psycopg2, psycopg2.extras
+
+from . import main as database
+
+
+# Global Variables
+BATCH_ROWS = 500            # Rows written in one transaction at most.
+FLUSH      = 2.0            # Seconds rows wait for more to join their transaction.
+MAX_QUEUED = 1000           # Batches queued at most, put() blocks past this.
+SPILL_PATH = "spill.jsonl"  # Rows that couldn't be written while the database was down.
+RETRY      = 30             # Seconds between attempts to replay the spill file.
+
+
+class WriteBehind:
+    """
+    Decouples the scrapers from the database. Batches of rows are put on a bounded
+    queue and written by a background thread, coalesced into large transactions
+    of up to `batch_rows` rows, or whatever arrived within `flush` seconds. A full
+    queue blocks the scrapers until the writer catches up.
+
+    A row that can't be written (e.g. a NUL in a scraped title) fails its whole
+    transaction, so a failed transaction is retried batch by batch, then row by
+    row, and only the offending rows are dropped.
+
+    While the database is unreachable, the rows are appended to a local spill file
+    instead, with the tag they were put with, and replayed once it is back. The
+    query must be idempotent (e.g. ON CONFLICT DO NOTHING), as a replay may repeat
+    rows that were already written. Rows of the spill file that can't be read or written
+    are moved to `<spill_path>.failed`.
+
+    Interface:
+        WriteBehind(query, batch_rows=BATCH_ROWS, flush=FLUSH, max_queued=MAX_QUEUED, spill_path=SPILL_PATH, on_replay=None)
+            - query: insert query with a single `VALUES %s`, see database.insert_many(). May have a RETURNING clause.
+            - on_replay(tag, rows, returned): called for the spilled rows once they are replayed, see put().
+
+        WriteBehind.put(rows, callback=None, tag=None)
+            - queue rows for writing. callback(returned) is called with the rows the query
+              returned for the whole transaction, once the rows are written. Without rows,
+              it is called in turn with the rows put before. Spilled rows
+              keep their tag instead, a callback can't outlive the process.
+
+        WriteBehind.close()
+            - write what is queued and stop. Called at exit.
+    """
+
+    def __init__( self, query : str, batch_rows : int = BATCH_ROWS, flush : float = FLUSH, max_queued : int = MAX_QUEUED, spill_path : str = SPILL_PATH, on_replay = None ):
+        self.query      : str   = query
+        self.batch_rows : int   = batch_rows
+        self.flush      : float = flush
+        self.spill_path : str   = spill_path
+        self.on_replay          = on_replay
+
+        self.queue      : queue.Queue = queue.Queue( maxsize = max_queued ) # (rows, callback, tag), None to stop.
+        self.thread     = threading.Thread( target = self._run, name = "writer", daemon = True )
+        self.thread.start()
+
+        atexit.register( self.close )
+
+
+    @classmethod
+    def from_config( cls, query : str, config : dict, on_replay = None ) -> "WriteBehind":
+        return cls(
+            query,
+            batch_rows = config.get( "batch_rows", BATCH_ROWS ),
+            flush      = config.get( "flush",      FLUSH ),
+            max_queued = config.get( "max_queued", MAX_QUEUED ),
+            spill_path = config.get( "spill_path", SPILL_PATH ),
+            on_replay  = on_replay,
+        )
+
+
+    #
+    #   Interface
+    #
+    def put( self, rows : list[tuple], callback = None, tag = None ):
+        if rows or callback:
+            self.queue.put( ( rows, callback, tag ) )
+
+
+    def close( self ):
+        if not self.thread.is_alive():
+            return
+
+        self.queue.put( None )
+        self.thread.join()
+
+
+    #
+    #   Implementation
+    #
+    def _run( self ):
+        # Rows left over from the last run are replayed after the first write, or
+        # once idle, by when the scrapers that handle them on_replay are up.
+        stopping = False
+        while not stopping:
+            try:
+                first = self.queue.get( timeout = RETRY )
+            except queue.Empty:
+                self._guarded( self._replay )
+                continue
+
+            if first is None:
+                break
+
+            # Coalesce whatever arrives until the transaction is full, or the flush time is up.
+            batches  = [ first ]
+            rows     = len( first[0] )
+            deadline = time.monotonic() + self.flush
+            while rows < self.batch_rows:
+                try:
+                    item = self.queue.get( timeout = max( 0.0, deadline - time.monotonic() ) )
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    stopping = True
+                    break
+
+                batches.append( item )
+                rows += len( item[0] )
+
+            self._guarded( self._write, batches )
+
+
+    def _guarded( self, func, *args ):
+        # The writer must outlive whatever goes wrong, or put() blocks every scraper once the queue is full.
+        try:
+            func( *args )
+        except Exception as e:
+            printl( f"[!] Writer failed: { repr(e) }" )
+
+
+    def _write( self, batches : list[tuple] ):
+        rows = [ row for batch, _, _ in batches for row in batch ]
+
+        try:
+            returned = self._execute( rows ) if rows else []
+
+        # Database unreachable, keep the rows for later.
+        except ( psycopg2.OperationalError, psycopg2.InterfaceError ) as e:
+            printl( f"[!] Database unreachable ({ e }), spilling { len(rows) } rows to { self.spill_path }." )
+            for batch, _, tag in batches:
+                self._spill( batch, tag )
+            return
+
+        # A bad row fails the whole transaction, don't lose the other forums' rows over it.
+        except Exception as e:
+            if len( batches ) > 1:
+                printl( f"[!] Could not write { len(rows) } rows ({ e }), retrying batch by batch." )
+                for batch in batches:
+                    self._write([ batch ])
+                return
+
+            printl( f"[!] Could not write { len(rows) } rows ({ e }), retrying row by row." )
+            batch, _, tag = batches[0]
+            returned      = self._write_rows( batch, tag )
+
+        for _, callback, _ in batches:
+            if not callback:
+                continue
+
+            try:
+                callback( returned )
+            except Exception as e:
+                printl( f"[!] Write callback failed: { e }" )
+
+        # Back up, catch up on the spilled rows.
+        if os.path.exists( self.spill_path ):
+            self._replay()
+
+
+    def _write_rows( self, rows : list[tuple], tag ) -> list:
+        returned = []
+        for index, row in enumerate( rows ):
+            try:
+                returned += self._execute([ row ])
+
+            except ( psycopg2.OperationalError, psycopg2.InterfaceError ) as e:
+                printl( f"[!] Database unreachable ({ e }), spilling { len(rows) - index } rows to { self.spill_path }." )
+                self._spill( rows[index:], tag )
+                break
+
+            except Exception as e:
+                printl( f"[!] Dropped a row that can't be written ({ e }): { str(row)[:200] }" )
+
+        return returned
+
+
+    def _execute( self, rows : list[tuple] ) -> list:
+        with database.cursor() as (conn, cur):
+            returned = psycopg2.extras.execute_values( cur, self.query, rows, fetch = "RETURNING" in self.query.upper() )
+            conn.commit()
+            return returned or []
+
+
+    def _spill( self, rows : list[tuple], tag ):
+        self._append( self.spill_path, [ json.dumps({ "tag" : tag, "row" : row }) for row in rows ] )
+
+
+    def _append( self, path : str, lines : list[str] ):
+        with open( path, "a+b" ) as file:
+
+            # A line torn by a kill would swallow the first one appended after it.
+            if file.seek( 0, os.SEEK_END ) > 0:
+                file.seek( -1, os.SEEK_END )
+                if file.read( 1 ) != b"\n":
+                    file.write( b"\n" )
+
+            file.write( "".join( line + "\n" for line in lines ).encode( "utf-8" ) )
+            file.flush()
+            os.fsync( file.fileno() )
+
+
+    def _replay( self ):
+        if not os.path.exists( self.spill_path ):
+            return
+
+        # Lines torn by a kill in the middle of an append can't be read, set them aside.
+        records, failed = [], []
+        with open( self.spill_path, "r", encoding = "utf-8", errors = "replace" ) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                try:
+                    records.append( read_record( line ) )
+                except ( ValueError, KeyError, TypeError ):
+                    printl( f"[!] Could not read a spilled row: { line.strip()[:200] }" )
+                    failed.append( line.rstrip( "\n" ) )
+
+        torn = len( failed )
+        try:
+            for start in range( 0, len(records), self.batch_rows ):
+                chunk = records[ start : start + self.batch_rows ]
+
+                try:
+                    returned = self._execute([ row for _, row in chunk ])
+
+                # Bad rows, set them aside rather than retry them forever.
+                except ( psycopg2.OperationalError, psycopg2.InterfaceError ):
+                    raise
+
+                except Exception:
+                    returned = []
+                    for tag, row in chunk:
+                        try:
+                            returned += self._execute([ row ])
+
+                        except ( psycopg2.OperationalError, psycopg2.InterfaceError ):
+                            raise
+
+                        except Exception as e:
+                            printl( f"[!] Could not replay a row ({ e }): { str(row)[:200] }" )
+                            failed.append( json.dumps({ "tag" : tag, "row" : row }) )
+
+                self._replayed( chunk, returned )
+
+        # Still down, try again later. Rows already replayed are repeated then, harmlessly.
+        except ( psycopg2.OperationalError, psycopg2.InterfaceError ):
+            return
+
+        if failed:
+            self._append( self.spill_path + ".failed", failed )
+
+        os.remove( self.spill_path )
+        printl( f"[✓] Replayed { len(records) - len(failed) + torn } spilled rows." + ( f" { len(failed) } moved to { self.spill_path }.failed" if failed else "" ) )
+
+
+    def _replayed( self, chunk : list[tuple], returned : list ):
+        if not self.on_replay:
+            return
+
+        for tag in { tag for tag, _ in chunk }:
+            try:
+                self.on_replay( tag, [ row for _tag, row in chunk if _tag == tag ], returned )
+            except Exception as e:
+                printl( f"[!] Replay callback failed: { e }" )
+
+
+def read_record( line : str ) -> tuple:
+    """
+    A line of the spill file as (tag, row). Spill files from before tags hold bare rows.
+
+    """
+    record = json.loads( line )
+    if isinstance( record, list ):
+        return None, tuple( record )
+
+    return record["tag"], tuple( record["row"] )
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
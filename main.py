@@ -1,31 +1,88 @@
 import os, sys, time, dotenv, tomllib, importlib; dotenv.load_dotenv()
 from pathlib import Path
 
-import tor.manager
-import sites.forum
+import tor.manager, tor.circuits, tor.retry
+import sites.forum, sites.backfill
+import scheduler.runner, scheduler.budget, scheduler.jobqueue
+import scraper.parsing
 
 from database.psql import main    as psql
 
 
 # Global Variables
 EXECUTION_POOL = []
+FORUMS         = {}            # Forum key in config.toml -> scraper object.
+BACKFILLS      = []            # sites.backfill.Backfill of the forums with `backfill = true`.
 CONFIG_PATH    = "config.toml" # os.getenv("CONFIG_PATH") # Uncomment this line to get config file from .env
 INTERVAL       = 5 * 60        # os.getenv("INTERVAL")    # Uncomment this line to get interval from .env
+WORKERS        = 4             # Forums monitored at the same time, unless set in [scheduler].
 PSQL_URL       = os.getenv( "PSQL_URL" )
 
 
 #
 #   Implementation
 #
-def execute_pool():
+def execute_pool( config : dict, budget : scheduler.budget.FetchBudget = None ):
     """
-    Executes the scraper pool.
+    Executes the scraper pool forever. Each scraper runs every `interval` seconds of its
+    forum config, or its own, or INTERVAL (fixed rate), concurrently with the others, and
+    never overlaps with itself. Scrapers due together run by `priority`, and are held
+    back while the shared fetch budget is spent. Backfills run in between, below the
+    scrapers, on their own fetch budgets.
+    
+    Expected config format:
+        
+        [scheduler]
+        workers            = 4   # Forums monitored at the same time.
+        fetches_per_minute = 0   # Fetches per minute across all forums, 0 for unlimited.
     
     """
     global EXECUTION_POOL
     
+    pool = scheduler.runner.Scheduler( workers = config.get( "workers", WORKERS ), budget = budget )
     for func in EXECUTION_POOL: 
-        func()
+        forum        = getattr( func, "__self__", func )
+        forum_config = getattr( forum, "config", {} )
+        
+        # Scrapers with adaptive polling run more often, but only poll the pages that are due.
+        pool.add( 
+            str( forum ), func, 
+            interval = forum_config.get( "interval", getattr( forum, "interval", INTERVAL ) ),
+            priority = forum_config.get( "priority", 0 ),
+        )
+    
+    # The history is walked when the live monitors leave room for it.
+    for backfill in BACKFILLS:
+        forum_config = backfill.forum.config
+        pool.add(
+            f"{ backfill.forum } (backfill)", backfill.run,
+            interval = forum_config.get( "backfill_interval", sites.backfill.INTERVAL ),
+            priority = forum_config.get( "backfill_priority", sites.backfill.PRIORITY ),
+        )
+    
+    pool.run_forever()
+    
+
+def execute_worker( config : dict, budget : scheduler.budget.FetchBudget = None ):
+    """
+    Executes the scrapers as one worker of many. The due pages are claimed from the
+    Postgres job queue, shared by every worker running on the same database, so
+    that several processes or hosts (e.g. with their own Tor egress) split the
+    forums between them without scraping a page twice.
+    Run with `python3 main.py --worker`.
+    
+    Expected config format:
+        
+        [scheduler]
+        workers = 4   # Pages polled at the same time by this worker.
+        lease   = 300 # Seconds a crashed worker's jobs stay claimed before others take them over.
+    
+    """
+    global FORUMS
+    
+    queue  = scheduler.jobqueue.JobQueue( lease = config.get( "lease", scheduler.jobqueue.LEASE ) )
+    worker = scheduler.jobqueue.Worker( FORUMS, queue, workers = config.get( "workers", WORKERS ), budget = budget )
+    worker.run_forever()
     
 
 def read_config() -> dict | None:
@@ -63,7 +120,35 @@ def build_scrapers( config : dict, Manager : tor.manager.Manager, ):
         forum_config = {
             "scraper" : "module.path.to.scraperClass",
             "object"  : "ClassName",   
-            "baseurl" : "https://example.com"
+            "baseurl" : "https://example.com",
+            
+            # Optional
+            "interval"            : 300,    # Seconds between runs, overrides the adaptive min_interval.
+            "priority"            : 0,      # Higher runs first when forums are due together, or the budget is short.
+            "max_concurrency"     : 4,      # Pages of the forum fetched at once.
+            "max_pages_per_cycle" : 10,     # Listing pages polled per run at most, the most overdue first.
+            "fetch_strategy"      : "auto", # "auto" (HTTP, browser on challenges), "http" or "browser".
+            "parser"              : "lxml", # "lxml" (fast, C) or "html.parser" (pure Python), see scraper.parsing.
+            "allow_resources"     : [],     # Resource types the browser may load, e.g. ["stylesheet"]. Images, fonts, media... are blocked.
+            "allow_urls"          : [],     # Url patterns the browser may always load, e.g. ["*/captcha/*"].
+            "ready_selector"      : "...",  # Selector of the listing, overrides the scraper's own.
+            "timeout"             : 30,     # Seconds a page may take before the fetch fails.
+            "latency_sensitive"   : False,  # Fetch over the fastest healthy circuit instead of the forum's own.
+            "min_interval"        : 120,    # Seconds between polls of the busiest listing pages...
+            "max_interval"        : 3600,   # ...and of the quietest ones.
+            "target_posts"        : 2.0,    # New posts a poll aims to find, sets the interval in between.
+            "seen_size"           : 10000,  # Links of stored posts remembered, to skip them before the database.
+            "timezone"            : "UTC",  # Time zone the forum shows its timestamps in, e.g. "Europe/Moscow".
+            "fetch_content"       : True,   # Fetch the first post of new threads as their content.
+            "content_concurrency" : 2,      # Threads fetched at once for their content.
+            "content_per_minute"  : 30,     # Threads fetched per minute at most for their content.
+            "content_queue"       : 1000,   # Threads waiting for their content at most, the rest go without.
+            "backfill"            : False,  # Walk the pagination of the listing pages for the threads missed, see sites.backfill.
+            "backfill_until"      : "2025-01-01", # Date the history is walked back to. Without it, only until the stored threads.
+            "backfill_per_minute" : 10,     # Backfill fetches per minute, apart from [scheduler] fetches_per_minute.
+            "backfill_pages"      : 5,      # Pages walked per run at most.
+            "backfill_interval"   : 60,     # Seconds between runs.
+            "backfill_priority"   : -1,     # Below the live monitors.
         }
     
     Args:
@@ -72,7 +157,7 @@ def build_scrapers( config : dict, Manager : tor.manager.Manager, ):
     """
     
     # Load in the forums from config
-    for _, forum_config in config["forums"].items():
+    for name, forum_config in config["forums"].items():
         scraper_module = importlib.import_module( forum_config["scraper"] )
         scraper_name   = forum_config.get( "object", "scrape" )
         
@@ -81,17 +166,28 @@ def build_scrapers( config : dict, Manager : tor.manager.Manager, ):
         # Create a Forum object.
         _forum_obj = scraper(
             url     = forum_config["baseurl"],
-            manager = Manager    
+            manager = Manager,
+            config  = forum_config
         )
         
         # Above mimics:
         # Breachforums( 
         #    url     = forum_config["baseurl"],
-        #    manager = Manager
+        #    manager = Manager,
+        #    config  = forum_config
         #)
         
         # Store objects.
         EXECUTION_POOL.append( _forum_obj.monitor )
+        FORUMS[name] = _forum_obj
+        
+        # Scrapers that can page through their listings walk the history as well.
+        if forum_config.get( "backfill", False ):
+            if not hasattr( _forum_obj, "page_url" ):
+                print(f"[{__name__}] [!] { name } can't page through its listings, no backfill.")
+                continue
+            
+            BACKFILLS.append( sites.backfill.Backfill.from_config( _forum_obj, forum_config ) )
     
         
         
@@ -105,15 +201,29 @@ def main():
     # Initialize 
     config = read_config()
     
-    Manager  = tor.manager.Manager() # Ready tor as a proxy
-    Forums   = sites.forum.Forums()  # Ready database for scraping forums
+    # Parse pool, one process per core unless set. workers = 0 parses in the scraper threads.
+    scraper.parsing.start( config.get( "parsing", {} ).get( "workers" ) )
+    
+    # Fetches per minute, shared by all the forums.
+    Budget   = scheduler.budget.FetchBudget( config.get( "scheduler", {} ).get( "fetches_per_minute", 0 ) )
+    
+    Manager  = tor.manager.Manager(  # Ready tor as a proxy
+        circuits = tor.circuits.CircuitPool.from_config( config.get( "tor", {} ) ),
+        policy   = tor.retry.RetryPolicy.from_config( config.get( "retry", {} ) ),
+        breaker  = tor.retry.Breaker.from_config( config.get( "retry", {} ) ),
+        budget   = Budget,
+    )
+    Forums   = sites.forum.Forums( config.get( "writer", {} ) )  # Ready database for scraping forums
     
     build_scrapers( config, Manager )
     
+    # Worker mode: share the forums with the other workers through the job queue.
+    if "--worker" in sys.argv:
+        execute_worker( config.get( "scheduler", {} ), Budget )
+        return
+    
     # Runs the scrapers forever with wanted interval, default to 5 mins.
-    while 1:
-        execute_pool()
-        time.sleep( INTERVAL )
+    execute_pool( config.get( "scheduler", {} ), Budget )
         
         
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+"""
+*   Adaptive polling intervals per listing page, driven by how fast posts arrive on it.
+"""
+import time
+from dataclasses import dataclass, field
+
+
+# Global Variables
+ALPHA = 0.3   # Weight of the newest poll in the arrival rate EWMA.
+
+
+@dataclass(slots = True)
+class PageState:
+    """
+    Polling state of one listing page.
+
+    """
+    rate      : float    = None    # EWMA of new posts per second, None until two polls were seen.
+    interval  : float    = 0.0     # Seconds between polls.
+    last_poll : float    = None    # time.monotonic() of the last successful poll.
+    next_due  : float    = 0.0     # time.monotonic() the page is due again.
+    links     : set[str] = field( default_factory = set ) # Links on the listing at the last poll.
+
+
+class AdaptivePoller:
+    """
+    Decides which listing pages of a forum are due for a poll. Each page's interval
+    aims for `target` new posts per poll, based on the EWMA of the arrival rate
+    observed between polls (links on the listing that weren't there the last time),
+    and is kept within [min_interval, max_interval]. Busy boards are polled often,
+    quiet ones rarely. Pages start at `min_interval` until their rate is known, and
+    pages that have seen no arrivals at all double their interval on every poll.
+    At most `limit` pages are polled at once, the most overdue first, the others
+    stay due for the next run.
+
+    Interface:
+        AdaptivePoller(min_interval=120, max_interval=3600, target=2.0, limit=None)
+
+        AdaptivePoller.due(pages) -> list[str]
+            - the pages due for a poll now, most overdue first.
+
+        AdaptivePoller.observe(page, links)
+            - record the links found on a successful poll of the page.
+    """
+
+    def __init__( self, min_interval : float = 120, max_interval : float = 3600, target : float = 2.0, limit : int = None ):
+        self.min_interval : float = min_interval
+        self.max_interval : float = max( min_interval, max_interval )
+        self.target       : float = target
+        self.limit        : int   = limit   # Pages polled per run at most, None for all that are due.
+
+        self.pages : dict[str, PageState] = {}
+
+
+    @classmethod
+    def from_config( cls, config : dict ) -> "AdaptivePoller":
+        return cls(
+            min_interval = config.get( "min_interval", 120  ),
+            max_interval = config.get( "max_interval", 3600 ),
+            target       = config.get( "target_posts", 2.0  ),
+            limit        = config.get( "max_pages_per_cycle" ),
+        )
+
+
+    #
+    #   Interface
+    #
+    def due( self, pages : list[str] ) -> list[str]:
+        now = time.monotonic()
+        due = [ page for page in pages if self._state( page ).next_due <= now ]
+        due.sort( key = lambda page: self.pages[page].next_due )
+        return due[:self.limit] if self.limit else due
+
+
+    def observe( self, page : str, links : list[str] ):
+        state = self._state( page )
+        now   = time.monotonic()
+        links = set( links )
+
+        # Arrivals since the last poll. The first poll only sets the baseline.
+        if state.last_poll is not None:
+            sample     = len( links - state.links ) / max( 1.0, now - state.last_poll )
+            state.rate = sample if state.rate is None else ALPHA * sample + ( 1 - ALPHA ) * state.rate
+
+        state.links, state.last_poll = links, now
+        state.interval = self._interval( state )
+        state.next_due = now + state.interval
+
+
+    def interval( self, page : str ) -> float:
+        return self._state( page ).interval
+
+
+    #
+    #   Implementation
+    #
+    def _state( self, page : str ) -> PageState:
+        if page not in self.pages:
+            self.pages[page] = PageState( interval = self.min_interval )
+        return self.pages[page]
+
+
+    def _interval( self, state : PageState ) -> float:
+        if state.rate is None:
+            return self.min_interval
+
+        # Nothing has arrived yet, back off gradually.
+        if state.rate <= 0:
+            return min( self.max_interval, state.interval * 2 )
+
+        return min( self.max_interval, max( self.min_interval, self.target / state.rate ) )
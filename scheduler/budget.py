@@ -0,0 +1,62 @@
+"""
+*   Global fetch budget, shared by all forums.
+"""
+import threading, time
+
+
+class FetchBudget:
+    """
+    Token bucket of fetches per minute, shared across the forums so that the
+    scrapers together stay within what the Tor circuits can carry. Refills
+    continuously; a full minute's worth can be spent in a burst.
+    A budget of 0 is unlimited.
+
+    Interface:
+        FetchBudget(per_minute=0)
+
+        FetchBudget.acquire(count=1)
+            - take `count` fetches from the budget, blocking until they are available.
+
+        FetchBudget.available() -> float
+            - fetches that can be made right now.
+    """
+
+    def __init__( self, per_minute : int = 0 ):
+        self.per_minute : int   = per_minute
+        self.tokens     : float = float( per_minute )
+        self.updated    : float = time.monotonic()   # time.monotonic() of the last refill.
+        self.lock       = threading.Condition()
+
+
+    #
+    #   Interface
+    #
+    def acquire( self, count : int = 1 ):
+        if not self.per_minute:
+            return
+
+        # A batch larger than the whole budget would never fit, it takes the whole budget instead.
+        count = min( count, self.per_minute )
+
+        with self.lock:
+            while self._refill() < count:
+                self.lock.wait( ( count - self.tokens ) * 60 / self.per_minute )
+            self.tokens -= count
+
+
+    def available( self ) -> float:
+        if not self.per_minute:
+            return float("inf")
+
+        with self.lock:
+            return self._refill()
+
+
+    #
+    #   Implementation
+    #
+    def _refill( self ) -> float:
+        now          = time.monotonic()
+        self.tokens  = min( self.per_minute, self.tokens + ( now - self.updated ) * self.per_minute / 60 )
+        self.updated = now
+        return self.tokens
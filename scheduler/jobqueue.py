@@ -0,0 +1,303 @@
+"""
+*   Postgres-backed job queue, for running the scrapers on several workers (processes or hosts).
+"""
+import os, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses        import dataclass
+from datetime           import datetime
+
+from database.psql import main as database
+
+from .budget import FetchBudget
+
+
+# Global Variables
+LEASE      = 5 * 60   # Seconds a claimed job is held by a worker without a heartbeat.
+HEARTBEAT  = 60       # Seconds between heartbeats of the jobs in flight.
+IDLE       = 5        # Seconds a worker waits when there is nothing to claim.
+BATCH      = 8        # Jobs claimed at once, at most.
+RETRY_BASE = 60       # Seconds before a failed job is due again, doubling per failed attempt.
+RETRY_CAP  = 3600
+
+
+@dataclass(slots = True)
+class QueueJob:
+    """
+    One listing page of a forum, claimed from the queue.
+
+    """
+    id       : int
+    forum    : str   # Key of the forum's table in config.toml.
+    page     : str   # Url of the listing page.
+    attempts : int   # Claims since the page was last polled successfully, this one included.
+
+
+class JobQueue:
+    """
+    Scrape jobs (forum, listing page, due time) in the ScrapeJob table.
+
+    Workers claim due jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, so no job is
+    handed to two workers. A claim is a lease: the worker extends it with
+    heartbeats while the job runs, and a job whose lease has run out (its worker
+    crashed or hung) is claimed again by the next worker. Times are the database's,
+    so the workers' clocks don't need to agree.
+
+    Interface:
+        JobQueue(worker=None, lease=LEASE)
+            - queue as seen by the worker `worker`, defaults to hostname:pid.
+
+        JobQueue.seed(forum, pages, priority=0)
+            - make sure the forum's pages have jobs, and update their priority.
+
+        JobQueue.claim(forums, limit=BATCH) -> list[QueueJob]
+            - lease the due jobs of the given forums, highest priority and most overdue first.
+
+        JobQueue.heartbeat(jobs)
+            - extend the leases of the jobs in flight.
+
+        JobQueue.complete(job, interval) / JobQueue.fail(job)
+            - release the job, due again after `interval` seconds, or after a back off.
+    """
+
+    def __init__( self, worker : str = None, lease : float = LEASE ):
+        self.worker : str   = worker or f"{ socket.gethostname() }:{ os.getpid() }"
+        self.lease  : float = lease
+
+        database.create_tables({ "ScrapeJob" : psql_queries.create_scrapejob_table })
+
+
+    #
+    #   Interface
+    #
+    def seed( self, forum : str, pages : list[str], priority : int = 0 ):
+        database.insert_data(
+            psql_queries.insert_into_scrapejob,
+            [ ( forum, page, priority ) for page in pages ]
+        )
+
+
+    def claim( self, forums : list[str], limit : int = BATCH ) -> list[QueueJob]:
+        rows = database.update_returning(
+            psql_queries.claim_scrapejobs,
+            ( self.worker, self.lease, list( forums ), limit )
+        )
+        return [ QueueJob( *row ) for row in rows or [] ]
+
+
+    def heartbeat( self, jobs : list[QueueJob] ):
+        if not jobs:
+            return
+
+        rows = database.update_returning(
+            psql_queries.extend_scrapejobs,
+            ( self.lease, self.worker, [ job.id for job in jobs ] )
+        )
+
+        # Held past the lease already, another worker may have the job now.
+        if rows is not False and len( rows ) < len( jobs ):
+            printl( f"[!] { len( jobs ) - len( rows ) } leases of { self.worker } were lost." )
+
+
+    def complete( self, job : QueueJob, interval : float ):
+        self._release( job, interval, psql_queries.complete_scrapejob )
+
+
+    def fail( self, job : QueueJob ):
+        self._release( job, min( RETRY_CAP, RETRY_BASE * 2 ** ( job.attempts - 1 ) ), psql_queries.fail_scrapejob )
+
+
+    #
+    #   Implementation
+    #
+    def _release( self, job : QueueJob, delay : float, query : str ):
+        # Only while we hold the lease, a reclaimed job belongs to its new worker.
+        if not database.update_returning( query, ( delay, job.id, self.worker ) ):
+            printl( f"[!] Lease of { job.page } was lost before it could be released." )
+
+
+class Worker:
+    """
+    Runs the forums' due pages from the job queue, next to other workers. Jobs of
+    the same forum claimed together are polled together, with the forum's own
+    concurrency. A page is due again after the interval its forum's poller
+    picks for it, a failed page after a back off.
+
+    Interface:
+        Worker(forums, queue, workers=4, budget=None)
+            - forums: config key -> scraper object, with `pages`, `poller` and `poll(pages)`.
+
+        Worker.run_forever()
+            - claim and run jobs until stop() is called.
+
+        Worker.stop()
+    """
+
+    def __init__( self, forums : dict, queue : JobQueue, workers : int = 4, budget : FetchBudget = None ):
+        self.forums   : dict        = forums
+        self.queue    : JobQueue    = queue
+        self.workers  : int         = max( 1, workers )
+        self.budget   : FetchBudget = budget or FetchBudget()
+        self.executor = ThreadPoolExecutor( max_workers = self.workers, thread_name_prefix = "worker" )
+
+        self.running  : dict[int, QueueJob] = {}  # Jobs in flight, by id.
+        self.busy     : int                 = 0   # Threads in use.
+        self.lock     = threading.Lock()
+        self.stopped  = threading.Event()
+
+
+    #
+    #   Interface
+    #
+    def run_forever( self ):
+        for key, forum in self.forums.items():
+            self.queue.seed( key, forum.pages, forum.config.get( "priority", 0 ) )
+
+        threading.Thread( target = self._heartbeat, name = "heartbeat", daemon = True ).start()
+        printl( f"[>] Worker { self.queue.worker } claiming jobs of { ', '.join( self.forums ) }." )
+
+        while not self.stopped.is_set():
+            with self.lock:
+                free = self.workers - self.busy
+
+            # All threads busy, or the fetch budget is spent.
+            if not free or self.budget.available() < 1:
+                self.stopped.wait( 1.0 )
+                continue
+
+            # A thread per forum claimed, so no more jobs than there are free threads.
+            # Leases aren't held by jobs that wait for a thread.
+            jobs = self.queue.claim( self.forums.keys(), min( free, BATCH ) )
+            if not jobs:
+                self.stopped.wait( IDLE )
+                continue
+
+            # One thread per forum, over its claimed pages.
+            groups : dict[str, list[QueueJob]] = {}
+            for job in jobs:
+                groups.setdefault( job.forum, [] ).append( job )
+
+            for key, group in groups.items():
+                with self.lock:
+                    self.busy += 1
+                    self.running.update({ job.id : job for job in group })
+                self.executor.submit( self._run, self.forums[key], group )
+
+
+    def stop( self ):
+        self.stopped.set()
+        self.executor.shutdown( wait = False, cancel_futures = True )
+
+
+    #
+    #   Implementation
+    #
+    def _run( self, forum, jobs : list[QueueJob] ):
+        try:
+            polled = forum.poll([ job.page for job in jobs ])
+
+        except Exception as e:
+            printl( f"[!] { forum } failed: { e }" )
+            polled = []
+
+        try:
+            for job in jobs:
+                if job.page in polled:
+                    self.queue.complete( job, forum.poller.interval( job.page ) )
+                else:
+                    self.queue.fail( job )
+
+        finally:
+            with self.lock:
+                self.busy -= 1
+                for job in jobs:
+                    self.running.pop( job.id, None )
+
+
+    def _heartbeat( self ):
+        while not self.stopped.wait( HEARTBEAT ):
+            with self.lock:
+                jobs = list( self.running.values() )
+            self.queue.heartbeat( jobs )
+
+
+#
+#   SQL Queries for the job queue
+#
+class psql_queries:
+
+    # Tables
+    create_scrapejob_table = """
+        CREATE TABLE IF NOT EXISTS ScrapeJob (
+            id          SERIAL PRIMARY KEY,
+            forum       TEXT NOT NULL,                   -- key of the forum in config.toml
+            page        TEXT NOT NULL,                   -- url of the listing page
+            priority    INTEGER NOT NULL DEFAULT 0,      -- higher is claimed first
+            due_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+            attempts    INTEGER NOT NULL DEFAULT 0,      -- claims since the last successful poll
+
+            leased_by   TEXT,                            -- worker holding the job, hostname:pid
+            lease_until TIMESTAMPTZ,                     -- the job is claimable again after this
+
+            CONSTRAINT scrapejob_page_unique UNIQUE (forum, page)
+        );
+        CREATE INDEX IF NOT EXISTS scrapejob_due ON ScrapeJob (due_at);
+    """
+
+    # Inserts
+    insert_into_scrapejob = """
+    INSERT INTO ScrapeJob (forum, page, priority) VALUES (%s, %s, %s)
+    ON CONFLICT (forum, page) DO UPDATE SET priority = EXCLUDED.priority;
+    """
+    """forum, page, priority"""
+
+    # Updates
+    claim_scrapejobs = """
+    UPDATE ScrapeJob SET
+        leased_by   = %s,
+        lease_until = now() + make_interval( secs => %s ),
+        attempts    = attempts + 1
+    WHERE id IN (
+        SELECT id FROM ScrapeJob
+        WHERE forum = ANY( %s )
+          AND due_at <= now()
+          AND ( lease_until IS NULL OR lease_until < now() )
+        ORDER BY priority DESC, due_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, forum, page, attempts;
+    """
+    """worker, lease, forums, limit"""
+
+    extend_scrapejobs = """
+    UPDATE ScrapeJob SET lease_until = now() + make_interval( secs => %s )
+    WHERE leased_by = %s AND id = ANY( %s ) AND lease_until >= now()
+    RETURNING id;
+    """
+    """lease, worker, ids"""
+
+    complete_scrapejob = """
+    UPDATE ScrapeJob SET
+        due_at      = now() + make_interval( secs => %s ),
+        attempts    = 0,
+        leased_by   = NULL,
+        lease_until = NULL
+    WHERE id = %s AND leased_by = %s
+    RETURNING id;
+    """
+    """interval, id, worker"""
+
+    fail_scrapejob = """
+    UPDATE ScrapeJob SET
+        due_at      = now() + make_interval( secs => %s ),
+        leased_by   = NULL,
+        lease_until = NULL
+    WHERE id = %s AND leased_by = %s
+    RETURNING id;
+    """
+    """delay, id, worker"""
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
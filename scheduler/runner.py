@@ -0,0 +1,173 @@
+"""
+*   Concurrent, fixed-rate scheduler for the forum monitors.
+"""
+import heapq, itertools, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses        import dataclass
+from datetime           import datetime
+
+from .budget import FetchBudget
+
+
+@dataclass(slots = True)
+class Job:
+    """
+    A function run every `interval` seconds.
+
+    """
+    name     : str
+    func     : object
+    interval : float
+    deadline : float                  # Seconds a run may take before it is reported as overrunning.
+    priority : int   = 0              # Higher runs first when several jobs are due, or the budget is short.
+    next_run : float = 0.0            # time.monotonic() of the next slot.
+    started  : float = None           # time.monotonic() the current run started, None when idle.
+    overran  : bool  = False          # Whether the current run was already reported as overrunning.
+    runs     : int   = 0
+    skipped  : int   = 0              # Slots skipped because the previous run was still going.
+
+
+class Scheduler:
+    """
+    Runs jobs concurrently on a thread pool, on a fixed-rate schedule: a job due
+    every 5 minutes starts every 5 minutes, however long its runs take. A job is
+    never run twice at the same time; a slot that comes up while the previous run
+    is still going is skipped.
+
+    Jobs due together are dispatched by priority. With a fetch budget, due jobs
+    are held back while the budget is spent, and the highest priority ones go
+    first once it refills.
+
+    Threads can't be killed, so a run past its deadline is reported, and the job
+    simply misses its slots until it returns. The fetch timeouts bound how long
+    that can be.
+
+    Interface:
+        Scheduler(workers=4, budget=None)
+            - new scheduler with `workers` threads, and the fetch budget the jobs spend.
+
+        Scheduler.add(name, func, interval, deadline=None, priority=0)
+            - run func() every `interval` seconds, first run right away. Deadline defaults to the interval.
+
+        Scheduler.run_forever()
+            - dispatch jobs until stop() is called.
+
+        Scheduler.stop()
+    """
+
+    def __init__( self, workers : int = 4, budget : FetchBudget = None ):
+        self.executor = ThreadPoolExecutor( max_workers = max(1, workers), thread_name_prefix = "monitor" )
+        self.budget   : FetchBudget = budget or FetchBudget()
+        self.jobs     : list[Job]   = []
+        self.queue    : list[tuple] = []   # Heap of (next_run, -priority, seq, job).
+        self.sequence = itertools.count()  # Tie breaker for jobs due at the same time.
+
+        self.lock     = threading.Lock()
+        self.stopped  = threading.Event()
+
+
+    #
+    #   Interface
+    #
+    def add( self, name : str, func, interval : float, deadline : float = None, priority : int = 0 ) -> Job:
+        job = Job(
+            name     = name,
+            func     = func,
+            interval = interval,
+            deadline = deadline or interval,
+            priority = priority,
+            next_run = time.monotonic(),
+        )
+
+        self.jobs.append( job )
+        self._push( job )
+        return job
+
+
+    def run_forever( self ):
+        while not self.stopped.is_set():
+            now = time.monotonic()
+
+            # Everything that is due, highest priority first.
+            due, held = [], False
+            while self.queue and self.queue[0][0] <= now:
+                due.append( heapq.heappop( self.queue )[-1] )
+
+            for job in sorted( due, key = lambda job: ( -job.priority, job.next_run ) ):
+                # Budget spent, the rest waits for it to refill, keeping its place.
+                if self.budget.available() < 1:
+                    self._push( job )
+                    held = True
+                    continue
+
+                self._dispatch( job, now )
+                self._push( job )
+
+            self._check_deadlines( now )
+
+            # Sleep until the next slot, waking up regularly to check the deadlines and the budget.
+            wait = min( 1.0, self.queue[0][0] - time.monotonic() ) if self.queue and not held else 1.0
+            self.stopped.wait( max( 0.0, wait ) )
+
+
+    def stop( self ):
+        self.stopped.set()
+        self.executor.shutdown( wait = False, cancel_futures = True )
+
+
+    #
+    #   Implementation
+    #
+    def _push( self, job : Job ):
+        heapq.heappush( self.queue, (job.next_run, -job.priority, next( self.sequence ), job) )
+
+
+    def _dispatch( self, job : Job, now : float ):
+
+        # Fixed rate: the next slot follows this one, not the end of the run.
+        # Slots missed altogether (e.g. a long overrun) are dropped rather than run back to back.
+        job.next_run += job.interval
+        while job.next_run <= now:
+            job.next_run += job.interval
+
+        with self.lock:
+            if job.started is not None:
+                job.skipped += 1
+                printl( f"[»] { job.name } is still running, skipping its slot." )
+                return
+
+            job.started, job.overran = now, False
+
+        future = self.executor.submit( job.func )
+        future.add_done_callback( lambda future: self._done( job, future ) )
+
+
+    def _done( self, job : Job, future : Future ):
+        with self.lock:
+            took        = time.monotonic() - job.started
+            job.started = None
+            job.runs   += 1
+
+        if future.cancelled():
+            return
+
+        if future.exception():
+            printl( f"[!] { job.name } failed after { took :.1f}s: { future.exception() }" )
+            return
+
+        printl( f"[✓] { job.name } done in { took :.1f}s." )
+
+
+    def _check_deadlines( self, now : float ):
+        with self.lock:
+            for job in self.jobs:
+                if job.started is None or job.overran or now - job.started < job.deadline:
+                    continue
+
+                job.overran = True
+                printl( f"[!] { job.name } has overrun its { job.deadline }s deadline." )
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
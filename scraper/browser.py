@@ -1,48 +1,478 @@
-from datetime import datetime
-from playwright.sync_api import *
+import asyncio, atexit, contextlib, threading, time
+from dataclasses  import dataclass
+from datetime     import datetime
+from fnmatch      import fnmatch
+from urllib.parse import urlparse
+from playwright.async_api import *
+
+from scraper.errors import HTTPStatusError
+
+
+# Global Variables
+POOL_SIZE       = 2                   # Warm Chromium instances, each on a thread of its own, shared by all fetch threads.
+PER_HOST        = 4                   # Navigations at once per context key (a forum), the others wait their turn.
+MAX_NAVIGATIONS = 100                 # Navigations a browser serves before it is restarted, bounds memory leaks.
+POOLS           : dict[bool, "BrowserPool"] = {}  # headless -> the pool of browsers.
+
+# Error statuses that may still turn into the page, e.g. challenges solved by the browser.
+PASS_STATUS = ( 403, 429, 503 )
+
+# Requests not needed for page.content(). Every avoided request is a Tor round trip saved.
+BLOCKED_TYPES = { "image", "media", "font", "stylesheet", "texttrack", "manifest" }
+BLOCKED_URLS  = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "facebook.net", "hotjar.com", "cloudflareinsights.com", "gravatar.com", "matomo", "/piwik.",
+)
+
+TOTALS : dict[str, "NavigationStats"] = {}   # host -> traffic of all navigations to it.
+LOCK   = threading.Lock()
+QUEUED = threading.local()   # Seconds the calling thread's navigations waited for their turn, see queued().
+
+
+#
+#   Navigation policy & stats
+#
+@dataclass(slots = True)
+class NavigationPolicy:
+    """
+    How a navigation behaves: which requests it is allowed to make, when the page
+    counts as ready and how long it may take. Everything in BLOCKED_TYPES and
+    BLOCKED_URLS is aborted unless allowed here.
+
+    Without a ready selector, a page is ready once the DOM is loaded. With one,
+    the html is returned as soon as the selector matches, and the navigation
+    fails once the timeout runs out.
+
+    Config (per forum):
+        allow_resources = ["stylesheet"]        # resource types let through
+        allow_urls      = ["*/captcha/*"]       # url patterns let through (fnmatch)
+        ready_selector  = "div.lp-item"         # overrides the forum's own selector
+        timeout         = 30                    # seconds per navigation
+    """
+    allow_types    : frozenset = frozenset()
+    allow_urls     : tuple     = ()
+    ready_selector : str       = None
+    timeout        : float     = 30
+
+    @classmethod
+    def from_config( cls, config : dict, ready_selector : str = None ) -> "NavigationPolicy":
+        return cls(
+            allow_types    = frozenset( config.get( "allow_resources", () ) ),
+            allow_urls     = tuple( config.get( "allow_urls", () ) ),
+            ready_selector = config.get( "ready_selector", ready_selector ),
+            timeout        = config.get( "timeout", 30 ),
+        )
+
+    def blocks( self, resource_type : str, url : str ) -> bool:
+        if any( fnmatch( url, pattern ) for pattern in self.allow_urls ):
+            return False
+
+        if resource_type in BLOCKED_TYPES:
+            return resource_type not in self.allow_types
+
+        return any( pattern in url for pattern in BLOCKED_URLS )
+
+
+@dataclass(slots = True)
+class NavigationStats:
+    """
+    Requests made, requests blocked and bytes received by navigations.
+
+    """
+    requests : int = 0
+    blocked  : int = 0
+    bytes    : int = 0
+
+    def reset( self ):
+        self.requests, self.blocked, self.bytes = 0, 0, 0
+
+    def add( self, other : "NavigationStats" ):
+        self.requests += other.requests
+        self.blocked  += other.blocked
+        self.bytes    += other.bytes
+
+    def __str__( self ): return f"{ self.requests } requests, { self.blocked } blocked, { self.bytes / 1024 :.1f} KiB"
+
+
+def stats() -> dict[str, NavigationStats]:
+    """
+    Returns the traffic of all navigations so far, per host.
+
+    """
+    with LOCK:
+        return { host : NavigationStats( total.requests, total.blocked, total.bytes ) for host, total in TOTALS.items() }
 
 
 #
 #   Open with Playwright,
 #
-def open( url : str, proxy : str = "socks5://127.0.0.1:9050", headless : bool = True ) -> str | None:
+def open( url : str, proxy : str = "socks5://127.0.0.1:9050", policy : NavigationPolicy = None, headless : bool = True, key : str = None ) -> str | None:
     """
     Uses playwright to fetch the HTML from a given url.
-    
+
+    The navigation runs on a warm browser of the BrowserPool, on the thread that
+    owns it, reusing the context and an idle page of the forum it belongs to.
+
     TODO: Handle CloudFlare and other CHAPTCHA.
-    
+
     Args:
         url (str): The url to scrape
-    
+
     Optional args:
-        proxy (str):     Proxy to use
-        headless (bool): Whether or not you want to use the browser as headless
-        
+        proxy (str):                 Proxy to use
+        policy (NavigationPolicy):   Requests to let through, defaults to blocking everything not needed
+        headless (bool):             Whether or not you want to use the browser as headless
+        key (str):                   Context key, pages sharing a key share cookies. Defaults to the url's host.
+
     Returns:
-        str: the html of the page. 
+        str: the html of the page.
     """
-    html : str = None
-    
     printl(f"[✈] Using Playwright to navigate to { url } ...")
-    with sync_playwright() as p:
-        # Open Browser
-        browser = p.chromium.launch( headless = headless )
-        context = browser.new_context(
-            proxy = { "server" : proxy },
-            ignore_https_errors=True
-        )
-        
-        # Navigate to the page
-        page = context.new_page()
-        page.goto(url)
-        page.wait_for_load_state("domcontentloaded")
-        html = page.content()
-        
-    # Done! 
-    printl("[✓] Page loaded. ")
+    policy = policy or NavigationPolicy()
+
+    html, page_stats, waited = pool( headless ).navigate( key or urlparse( url ).netloc, url, proxy, policy )
+    QUEUED.seconds = getattr( QUEUED, "seconds", 0.0 ) + waited
+
+    # Done!
+    _record( url, page_stats )
+    printl(f"[✓] Page loaded. { page_stats }")
     return html
 
 
+def queued() -> float:
+    """
+    Returns the seconds this thread's navigations waited behind the others since
+    the last call, and starts over. Not part of their latency, see tor.manager.
+
+    """
+    seconds, QUEUED.seconds = getattr( QUEUED, "seconds", 0.0 ), 0.0
+    return seconds
+
+
+def pool( headless : bool = True ) -> "BrowserPool":
+    """
+    Returns the BrowserPool shared by all threads, creating it on first use.
+
+    Args:
+        headless (bool): Whether or not the pooled browsers are headless
+    """
+    with LOCK:
+        if headless not in POOLS:
+            POOLS[headless] = BrowserPool( headless = headless )
+
+        return POOLS[headless]
+
+
+def close():
+    """
+    Closes the browser pools.
+
+    """
+    with LOCK:
+        pools = list( POOLS.values() )
+        POOLS.clear()
+
+    for browser_pool in pools:
+        browser_pool.close()
+
+
+#
+#   Browser pool
+#
+class BrowserPool:
+    """
+    Pool of `size` long-lived Chromium browsers, shared by every thread.
+
+    Playwright is bound to the thread that started it, so each browser is owned
+    by a thread of its own, running Playwright's async API on an event loop.
+    Navigations are handed to it from whichever thread asked for them, and run
+    concurrently, up to `per_host` at once per context key. That bounds the
+    browsers at `size`, however many threads fetch, without fetching a forum's
+    pages one after another.
+
+    Each context key (a forum) is pinned to one browser, where its context is kept
+    and its pages are recycled across navigations. Browsers are health checked
+    before use, and restarted after `max_navigations` navigations once the ones
+    in flight are done.
+
+    Interface:
+        BrowserPool(size=POOL_SIZE, max_navigations=MAX_NAVIGATIONS, headless=True, per_host=PER_HOST)
+            - new pool. Browsers are launched lazily.
+
+        BrowserPool.navigate(key, url, proxy, policy) -> tuple[str, NavigationStats, float]
+            - navigate a page of the key to the url, and return its html, and the seconds it
+              waited for its turn. Blocks until it is done.
+
+        BrowserPool.close()
+            - close every browser and stop Playwright.
+    """
+
+    def __init__( self, size : int = POOL_SIZE, max_navigations : int = MAX_NAVIGATIONS, headless : bool = True, per_host : int = PER_HOST ):
+        self.owners   : list[_Owner]      = [ _Owner( f"browser-{ number }", headless, max_navigations, per_host ) for number in range( max(1, size) ) ]
+        self.assigned : dict[str, _Owner] = {}  # Context key -> owner of the browser it is pinned to.
+        self.lock     = threading.Lock()
+
+
+    #
+    #   Interface
+    #
+    def navigate( self, key : str, url : str, proxy : str, policy : NavigationPolicy ) -> tuple[str, NavigationStats, float]:
+        return self._owner( key ).run( _navigate, key, url, proxy, policy, time.monotonic() )
+
+
+    def close( self ):
+        for owner in self.owners:
+            owner.stop()
+
+
+    #
+    #   Implementation
+    #
+    def _owner( self, key : str ) -> "_Owner":
+        with self.lock:
+
+            # Pin new keys to the browser with the least keys on it.
+            if key not in self.assigned:
+                self.assigned[key] = min(
+                    self.owners,
+                    key = lambda owner: sum( 1 for pinned in self.assigned.values() if pinned is owner )
+                )
+
+            return self.assigned[key]
+
+
+class _Owner:
+    """
+    Thread owning one pooled browser, and the Playwright instance that drives it.
+    Runs the coroutines handed to it on its event loop, concurrently.
+
+    """
+
+    def __init__( self, name : str, headless : bool, max_navigations : int, per_host : int ):
+        self.headless        : bool = headless
+        self.max_navigations : int  = max_navigations
+        self.per_host        : int  = per_host
+
+        self.browser  : _Browser = None
+        self.starting = asyncio.Lock()
+        self.loop     = asyncio.new_event_loop()
+        self.thread   = threading.Thread( target = self._run, name = name, daemon = True )
+        self.thread.start()
+
+
+    def run( self, func, *args ):
+        return asyncio.run_coroutine_threadsafe( self._call( func, *args ), self.loop ).result()
+
+
+    def stop( self ):
+        if not self.thread.is_alive():
+            return
+
+        asyncio.run_coroutine_threadsafe( self._close(), self.loop ).result()
+        self.loop.call_soon_threadsafe( self.loop.stop )
+        self.thread.join()
+
+
+    def _run( self ):
+        asyncio.set_event_loop( self.loop )
+        self.loop.run_forever()
+        self.loop.close()
+
+
+    async def _call( self, func, *args ):
+        # Started on the first call, on this thread, which owns it from then on.
+        async with self.starting:
+            if self.browser is None:
+                self.browser = _Browser( await async_playwright().start(), self.headless, self.max_navigations, self.per_host )
+
+        return await func( self.browser, *args )
+
+
+    async def _close( self ):
+        if self.browser is None:
+            return
+
+        await self.browser.close()
+        try:
+            await self.browser.playwright.stop()
+        except Error:
+            pass
+
+
+class _Browser:
+    """
+    One pooled Chromium instance, with its contexts and recycled pages.
+
+    """
+
+    def __init__( self, playwright, headless : bool, max_navigations : int, per_host : int ):
+        self.playwright      = playwright
+        self.headless        = headless
+        self.max_navigations = max_navigations
+        self.per_host        = per_host
+
+        self.browser     : Browser = None
+        self.contexts    : dict[tuple, BrowserContext] = {}
+        self.pages       : dict[tuple, list[tuple[Page, NavigationStats]]] = {} # Idle pages of each context.
+        self.slots       : dict[str, asyncio.Semaphore] = {}  # Context key -> its navigations at once.
+        self.navigations : int = 0
+        self.active      : int = 0  # Navigations in flight.
+        self.idle        = asyncio.Condition()
+
+
+    def healthy( self ) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+
+    async def launch( self ):
+        await self.close()
+        self.browser = await self.playwright.chromium.launch( headless = self.headless )
+
+
+    def slot( self, key : str ) -> asyncio.Semaphore:
+        return self.slots.setdefault( key, asyncio.Semaphore( max(1, self.per_host) ) )
+
+
+    @contextlib.asynccontextmanager
+    async def session( self ):
+        async with self.idle:
+
+            # Restart browsers that have served their share to bound memory leaks, once their navigations are done.
+            if self.navigations >= self.max_navigations:
+                await self.idle.wait_for( lambda: self.active == 0 )
+
+                if self.navigations >= self.max_navigations:
+                    printl(f"[♻] Restarting browser after { self.navigations } navigations.")
+                    await self.launch()
+
+            if not self.healthy():
+                await self.launch()
+
+            self.active += 1
+
+        try:
+            yield
+
+        finally:
+            async with self.idle:
+                self.active      -= 1
+                self.navigations += 1
+                self.idle.notify_all()
+
+
+    async def page( self, key : str, proxy : str, policy : NavigationPolicy ) -> tuple[Page, NavigationStats]:
+        # Recycle an idle page of the context, if still usable.
+        idle = self.pages.setdefault( (key, proxy), [] )
+        while idle:
+            page, page_stats = idle.pop()
+            if not page.is_closed():
+                return page, page_stats
+
+        context = self.contexts.get( (key, proxy) )
+        if context is None:
+            context = self.contexts[ (key, proxy) ] = await self.browser.new_context(
+                proxy = { "server" : proxy },
+                ignore_https_errors=True
+            )
+
+        page       = await context.new_page()
+        page_stats = NavigationStats()
+
+        # Block what isn't needed and count what went through.
+        await page.route( "**/*", lambda route: _route( route, policy, page_stats ) )
+        page.on( "requestfinished", lambda request: _count( request, page_stats ) )
+
+        return page, page_stats
+
+
+    def release( self, key : str, proxy : str, page : Page, page_stats : NavigationStats ):
+        # Pages of a browser that was restarted meanwhile are closed already.
+        if not page.is_closed():
+            self.pages.setdefault( (key, proxy), [] ).append( ( page, page_stats ) )
+
+
+    async def discard( self, page : Page ):
+        try:
+            await page.close()
+        except Error:
+            pass
+
+
+    async def close( self ):
+        try:
+            if self.browser: await self.browser.close()
+        except Error:
+            pass
+
+        self.browser     = None
+        self.navigations = 0
+        self.contexts.clear()
+        self.pages.clear()
+
+
+atexit.register( close )
+
+
+#
+#   Implementation
+#
+async def _navigate( browser : "_Browser", key : str, url : str, proxy : str, policy : NavigationPolicy, submitted : float ) -> tuple[str, NavigationStats, float]:
+    # Runs on the event loop of the thread owning the browser, next to the other navigations.
+    async with browser.slot( key ), browser.session():
+        waited = time.monotonic() - submitted
+        page, page_stats = await browser.page( key, proxy, policy )
+        page_stats.reset()
+
+        try:
+            deadline = time.monotonic() + policy.timeout
+
+            # Navigate to the page, and wait until what we need is there.
+            response = await page.goto( url, wait_until = "commit", timeout = _remaining( deadline ) )
+            if response and response.status >= 400 and response.status not in PASS_STATUS:
+                raise HTTPStatusError( url, response.status )
+
+            if policy.ready_selector:
+                await page.wait_for_selector( policy.ready_selector, state = "attached", timeout = _remaining( deadline ) )
+            else:
+                await page.wait_for_load_state( "domcontentloaded", timeout = _remaining( deadline ) )
+
+            html = await page.content()
+
+        # A page that raised is discarded.
+        except Exception:
+            await browser.discard( page )
+            raise
+
+        browser.release( key, proxy, page, page_stats )
+
+        # The stats go on counting on the owner's loop, the caller gets them as they are now.
+        return html, NavigationStats( page_stats.requests, page_stats.blocked, page_stats.bytes ), waited
+
+
+async def _route( route : Route, policy : NavigationPolicy, page_stats : NavigationStats ):
+    if policy.blocks( route.request.resource_type, route.request.url ):
+        page_stats.blocked += 1
+        return await route.abort()
+
+    await route.continue_()
+
+
+async def _count( request : Request, page_stats : NavigationStats ):
+    sizes = await request.sizes()
+    page_stats.requests += 1
+    page_stats.bytes    += sizes["responseBodySize"] + sizes["responseHeadersSize"]
+
+
+def _remaining( deadline : float ) -> float:
+    # Milliseconds left until the deadline, as Playwright expects them. Never 0, which would mean no timeout.
+    return max( 1, ( deadline - time.monotonic() ) * 1000 )
+
+
+def _record( url : str, page_stats : NavigationStats ):
+    with LOCK:
+        TOTALS.setdefault( urlparse( url ).netloc, NavigationStats() ).add( page_stats )
+
+
 # Helper functions.
 def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
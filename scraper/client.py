@@ -0,0 +1,115 @@
+"""
+*   Plain HTTP client, the fast path for server-rendered pages.
+"""
+import threading, requests, urllib3
+from datetime import datetime
+
+from scraper.errors import ChallengeError, HTTPStatusError
+
+
+# Global Variables
+SESSIONS = threading.local()  # requests.Session isn't thread safe, sessions are kept per thread and proxy.
+HEADERS  = {
+    "User-Agent"      : "Mozilla/5.0 (Windows NT 10.0; rv:128.0) Gecko/20100101 Firefox/128.0", # Tor Browser
+    "Accept"          : "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language" : "en-US,en;q=0.5",
+    "Accept-Encoding" : "gzip, deflate",
+}
+
+# Markers of anti-bot challenges and pages that need a JavaScript engine.
+CHALLENGE_STATUS  = ( 403, 503 )
+CHALLENGE_MARKERS = (
+    "challenge-platform", "cf-chl-", "<title>just a moment...</title>", # Cloudflare
+    "ddos-guard", "checking your browser",                              # DDoS-Guard & co.
+    "enable javascript and cookies to continue", "please enable javascript",
+)
+
+urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+
+#
+#   Interface
+#
+def get( url : str, proxy : str = "socks5://127.0.0.1:9050", timeout : float = 30 ) -> str:
+    """
+    Fetches the HTML from a given url without a browser.
+    Connections are kept alive between calls and responses are compressed.
+    
+    Args:
+        url (str): The url to fetch
+    
+    Optional args:
+        proxy (str):     Proxy to use
+        timeout (float): Seconds to wait for the server
+        
+    Returns:
+        str: the html of the page.
+        
+    Raises:
+        ChallengeError: the page needs a browser.
+        HTTPStatusError: the page answered with an error status.
+        requests.RequestException: the page could not be fetched.
+    """
+    printl(f"[⚡] Fetching { url } ...")
+    response = session( proxy ).get( url, timeout = timeout, verify = False )
+    
+    reason = challenge( response )
+    if reason:
+        raise ChallengeError( url, reason )
+    
+    if response.status_code >= 400:
+        raise HTTPStatusError( url, response.status_code )
+    
+    # Done!
+    printl(f"[✓] Page fetched, { len(response.content) } bytes.")
+    return response.text
+
+
+def session( proxy : str ) -> requests.Session:
+    """
+    Returns the calling thread's keep-alive session for the proxy.
+    
+    Args:
+        proxy (str): Proxy the session uses
+    """
+    sessions = getattr( SESSIONS, "sessions", None )
+    if sessions is None:
+        sessions = SESSIONS.sessions = {}
+    
+    if proxy not in sessions:
+        # socks5h resolves hostnames on the proxy, required for .onion addresses.
+        proxy_url = proxy.replace( "socks5://", "socks5h://", 1 )
+        
+        sessions[proxy] = requests.Session()
+        sessions[proxy].headers.update( HEADERS )
+        sessions[proxy].proxies.update({ "http" : proxy_url, "https" : proxy_url })
+    
+    return sessions[proxy]
+
+
+def challenge( response : requests.Response ) -> str | None:
+    """
+    Checks whether a response is a challenge or a JavaScript wall.
+    
+    Returns:
+        str: reason why the response needs a browser, None if it doesn't.
+    """
+    head = response.text[:8192].lower()
+    
+    for marker in CHALLENGE_MARKERS:
+        if marker in head:
+            return f"'{ marker }' in the page"
+    
+    if response.status_code in CHALLENGE_STATUS:
+        return f"HTTP { response.status_code }"
+    
+    # Almost empty documents that only run scripts.
+    if len( response.content ) < 1024 and "<script" in head:
+        return "script-only page"
+    
+    return None
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
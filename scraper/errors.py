@@ -0,0 +1,25 @@
+"""
+*   Errors raised by the fetchers.
+"""
+
+
+class ChallengeError(Exception):
+    """
+    The page answered with an anti-bot challenge or a JavaScript wall instead of content.
+
+    """
+    def __init__( self, url : str, reason : str ):
+        self.url    = url
+        self.reason = reason
+        super().__init__( f"Challenge at { url }: { reason }" )
+
+
+class HTTPStatusError(Exception):
+    """
+    The page answered with an HTTP error status.
+
+    """
+    def __init__( self, url : str, status : int ):
+        self.url    = url
+        self.status = status
+        super().__init__( f"HTTP { status } at { url }" )
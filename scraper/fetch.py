@@ -0,0 +1,127 @@
+"""
+*   Fetch strategies: plain HTTP first, Playwright when the page requires it.
+"""
+import time, threading
+from collections.abc    import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime           import datetime
+from urllib.parse       import urlparse
+
+from scraper        import browser, client, parsing
+from scraper.errors import ChallengeError
+
+
+# Global Variables
+STRATEGIES     = ( "auto", "http", "browser" )
+STICKY_BROWSER = 30 * 60   # Seconds a host stays on the browser after it served a challenge in "auto".
+WORKERS        = 16        # Threads for concurrent HTTP fetches. Kept alive so their sessions stay warm.
+
+EXECUTOR       = ThreadPoolExecutor( max_workers = WORKERS, thread_name_prefix = "fetch" )
+NEEDS_BROWSER  : dict[str, float] = {}   # host -> time until which "auto" goes straight to the browser.
+LOCK           = threading.Lock()
+
+
+#
+#   Interface
+#
+def fetch( url : str, proxy : str = "socks5://127.0.0.1:9050", strategy : str = "auto", policy : browser.NavigationPolicy = None ) -> str | None:
+    """
+    Fetches the HTML of a page with the given strategy.
+
+    Strategies:
+        "http":    plain HTTP client only.
+        "browser": Playwright only.
+        "auto":    plain HTTP, falling back to Playwright on challenges and JavaScript walls.
+
+    Args:
+        url (str): The url to scrape
+
+    Optional args:
+        proxy (str):                 Proxy to use
+        strategy (str):              One of STRATEGIES
+        policy (NavigationPolicy):   Requests the browser lets through
+
+    Returns:
+        str: the html of the page.
+    """
+    policy = policy or browser.NavigationPolicy()
+
+    if strategy == "browser" or ( strategy == "auto" and _needs_browser( url ) ):
+        return browser.open( url, proxy, policy )
+
+    try:
+        return _get( url, proxy, strategy, policy )
+
+    except ChallengeError as e:
+        if strategy == "http":
+            raise
+
+        printl(f"[↪] { e }. Falling back to the browser.")
+        _mark_browser( url )
+        return browser.open( url, proxy, policy )
+
+
+def stream( func, urls : list[str], concurrency : int = 4 ) -> Iterator[ tuple[str, str | None] ]:
+    """
+    Runs func(url) for the urls concurrently on the fetch threads, and yields
+    (url, result) as each page arrives, so the caller can parse and store a page,
+    and let go of its HTML, while the others are still loading.
+
+    At most `concurrency` urls are handed to the shared fetch threads at a time,
+    the next one as each finishes, so one forum's pages never queue up on the
+    threads the other forums' fetches need.
+
+    Returns:
+        Iterator: (url, html) in the order the pages arrive, html None for the pages that failed.
+    """
+    pending = iter( urls )
+    futures = {}
+
+    def submit():
+        url = next( pending, None )
+        if url is not None:
+            futures[ EXECUTOR.submit( func, url ) ] = url
+
+    for _ in range( max(1, concurrency) ):
+        submit()
+
+    while futures:
+        done, _ = wait( futures, return_when = FIRST_COMPLETED )
+        for future in done:
+            url = futures.pop( future )
+            submit()
+
+            try:
+                yield url, future.result()
+
+            except Exception as e:
+                printl(f"[!] Could not fetch { url }: { e }")
+                yield url, None
+
+
+#
+#   Implementation
+#
+def _get( url : str, proxy : str, strategy : str, policy : browser.NavigationPolicy ) -> str:
+    html = client.get( url, proxy, policy.timeout )
+
+    # In "auto", a page without the ready selector is one that needs a browser to render it.
+    if strategy == "auto" and policy.ready_selector and not parsing.present( html, policy.ready_selector ):
+        raise ChallengeError( url, f"no '{ policy.ready_selector }' in the page" )
+
+    return html
+
+
+def _needs_browser( url : str ) -> bool:
+    with LOCK:
+        return NEEDS_BROWSER.get( urlparse( url ).netloc, 0 ) > time.monotonic()
+
+
+def _mark_browser( url : str ):
+    with LOCK:
+        NEEDS_BROWSER[ urlparse( url ).netloc ] = time.monotonic() + STICKY_BROWSER
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
@@ -0,0 +1,163 @@
+"""
+*   HTML parsing backends for the forum parsers.
+"""
+import multiprocessing, os, re, threading
+from concurrent.futures         import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime                   import datetime
+
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+try:
+    import lxml.html as lxml_html
+except ImportError:
+    lxml_html = None
+
+
+# Global Variables
+BACKENDS    = ( "lxml", "html.parser" )
+DEFAULT     = "lxml"        # C parser, several times faster than the pure-Python "html.parser".
+FALLBACK    = "html.parser" # Always available, used when a backend isn't installed.
+UNAVAILABLE : set[str] = set()
+LOCK        = threading.Lock()
+POOL        : ProcessPoolExecutor = None # Parse pool, None parses in the calling thread.
+WORKERS     : int                 = 0    # Processes in the parse pool.
+SIMPLE      = re.compile( r"^([a-zA-Z][\w-]*)?((?:\.[\w-]+)+)$" ) # "tag.class.class" selectors, see present().
+
+
+#
+#   Interface
+#
+def parse( html : str, backend : str = DEFAULT, only : SoupStrainer = None ) -> BeautifulSoup:
+    """
+    Parses a page into a BeautifulSoup tree with the given backend, so the parsers'
+    CSS selectors work the same whichever is used.
+
+    Args:
+        html (str): The page to parse
+
+    Optional args:
+        backend (str):       One of BACKENDS. Falls back to "html.parser" if not installed.
+        only (SoupStrainer): Build only the matching elements and their subtrees, e.g. the thread list.
+
+    Returns:
+        BeautifulSoup: the parsed page.
+    """
+    if backend in UNAVAILABLE:
+        backend = FALLBACK
+
+    try:
+        return BeautifulSoup( html, backend, parse_only = only )
+
+    except FeatureNotFound:
+        with LOCK:
+            if backend not in UNAVAILABLE:
+                printl( f"[!] Parser '{ backend }' is not installed, using '{ FALLBACK }'." )
+            UNAVAILABLE.add( backend )
+
+        return BeautifulSoup( html, FALLBACK, parse_only = only )
+
+
+def strainer( name : str, css_class : str ) -> SoupStrainer:
+    """
+    SoupStrainer for the `name` elements having the class `css_class`, among others.
+    A plain `class_=` is matched against the whole class attribute while the page is
+    being built, so it would miss e.g. <div class="post_body scaleimages">.
+
+    """
+    return SoupStrainer( name, class_ = re.compile( rf"(?:^|\s){ re.escape( css_class ) }(?:\s|$)" ) )
+
+
+def present( html : str, selector : str ) -> bool:
+    """
+    Whether the CSS selector matches in the page. Simple selectors, e.g. "div.lp-item",
+    are looked up with lxml, without building a BeautifulSoup tree. Others, or without
+    lxml installed, parse the whole page.
+
+    """
+    simple = SIMPLE.match( selector )
+    if not simple or lxml_html is None:
+        return parse( html ).select_one( selector ) is not None
+
+    name, classes = simple.group( 1 ) or "*", simple.group( 2 ).split( "." )[1:]
+
+    # Not even the class name in the page, nothing to parse.
+    if classes[0] not in html:
+        return False
+
+    try:
+        document = lxml_html.fromstring( html )
+    except ( ValueError, lxml_html.etree.ParserError ):
+        return False
+
+    tests = "".join( f"[contains(concat(' ', normalize-space(@class), ' '), ' { css_class } ')]" for css_class in classes )
+    return bool( document.xpath( f"( //{ name }{ tests } )[1]" ) )
+
+
+def start( workers : int = None ):
+    """
+    Starts the parse pool, so that parsing runs on all cores instead of contending
+    for the GIL with the fetching threads.
+
+    Optional args:
+        workers (int): Processes in the pool, one per core by default. 0 parses
+                       synchronously in the calling thread, e.g. for debugging.
+    """
+    global POOL, WORKERS
+
+    if workers == 0 or POOL is not None:
+        return
+
+    WORKERS = workers or os.cpu_count()
+    POOL    = _pool()
+    printl( f"[>] Parsing on { WORKERS } processes." )
+
+
+def run_all( func, calls : list[tuple] ) -> list:
+    """
+    Runs func(*args) for every args in `calls`, in the parse pool if it is started.
+    The function must be a module-level function, and its arguments and results
+    plain data, as they cross process boundaries.
+
+    Returns:
+        list: the results, in the order of `calls`.
+    """
+    pool = POOL
+    if pool is None:
+        return [ func( *args ) for args in calls ]
+
+    try:
+        futures = [ pool.submit( func, *args ) for args in calls ]
+        return [ future.result() for future in futures ]
+
+    # A parse process died (e.g. out of memory), don't lose the pages over it. The next call gets a new pool.
+    except BrokenProcessPool as e:
+        printl( f"[!] Parse pool broken ({ e }), parsing in-process and restarting it." )
+        _restart( pool )
+        return [ func( *args ) for args in calls ]
+
+
+#
+#   Implementation
+#
+def _pool() -> ProcessPoolExecutor:
+    # Spawned, not forked: the parent runs threads (Playwright, Tor events) a fork would copy mid-flight.
+    return ProcessPoolExecutor( max_workers = WORKERS, mp_context = multiprocessing.get_context( "spawn" ) )
+
+
+def _restart( broken : ProcessPoolExecutor ):
+    global POOL
+
+    with LOCK:
+        # Another thread got there first.
+        if POOL is not broken:
+            return
+
+        POOL = _pool()
+
+    broken.shutdown( wait = False, cancel_futures = True )
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
@@ -0,0 +1,185 @@
+"""
+*   Backfill: walks the pagination of the listing pages back in time, for the threads the live monitor never saw.
+"""
+from dataclasses import dataclass, field
+from datetime    import datetime, timezone
+
+from database.psql import main as database
+from scheduler.budget import FetchBudget
+from sites.forum import store_posts
+
+
+# Global Variables
+PER_MINUTE = 10    # Backfill fetches per minute at most, per forum. Not taken from the live monitors' budget.
+PAGES      = 5     # Pages walked per run at most.
+INTERVAL   = 60    # Seconds between runs.
+PRIORITY   = -1    # Below the live monitors, which default to 0.
+FIRST      = 2     # Page 1 is the live monitor's.
+
+
+@dataclass(slots = True)
+class Cursor:
+    """
+    Position of the walk over one listing page's pagination.
+
+    """
+    number  : int      = FIRST  # Next page to fetch.
+    history : bool     = False  # Whether a walk has reached `until`, or the last page, before.
+    done    : bool     = False  # Whether the current walk is over.
+    last    : set[str] = field( default_factory = set ) # Links of the previous page, to notice the end of the pagination.
+
+
+class Backfill:
+    """
+    Walks the pagination of a forum's listing pages, from page 2 onwards, and
+    stores the threads that aren't stored yet through the bulk insert path.
+    The walk of each listing page is checkpointed in the BackfillCursor table
+    after every page, so it resumes where it was after a crash or a failed fetch.
+
+    A walk stops at the last page, once every thread on a page is older than
+    `until`, or once a page has no thread that isn't stored yet. The latter only
+    counts when there is no `until`, or when its history was walked before, as
+    stored threads drift from page 1 to the next ones between polls. Finished
+    walks start over on the next start, to catch up on what was posted while
+    the scrapers were down.
+
+    Fetches are spent from the backfill's own budget, and the runs are meant to
+    be scheduled below the live monitors, see main.execute_pool().
+
+    Interface:
+        Backfill(forum, until=None, per_minute=PER_MINUTE, pages=PAGES)
+            - forum: scraper with `pages`, page_url(page, number), listing(url, budget) and on_new(posts).
+            - until: date (or datetime, or ISO string) the history is walked back to.
+
+        Backfill.run() -> bool
+            - walk up to `pages` more pages. Use this in a loop.
+            - False if a fetch failed, the walk resumes from there on the next run.
+    """
+
+    def __init__( self, forum, until = None, per_minute : int = PER_MINUTE, pages : int = PAGES ):
+        self.forum  = forum
+        self.until  : datetime    = as_datetime( until )
+        self.budget : FetchBudget = FetchBudget( per_minute )
+        self.pages  : int         = pages
+
+        # Walks that were over start again, those that weren't resume.
+        self.cursors : dict[str, Cursor] = {}
+        for page, number, history, done in database.query_database( psql_queries.select_cursors, ( forum.forum_id, ) ) or []:
+            self.cursors[page] = Cursor( FIRST if done else number, history )
+
+
+    @classmethod
+    def from_config( cls, forum, config : dict ) -> "Backfill":
+        return cls(
+            forum,
+            until      = config.get( "backfill_until" ),
+            per_minute = config.get( "backfill_per_minute", PER_MINUTE ),
+            pages      = config.get( "backfill_pages",      PAGES ),
+        )
+
+
+    #
+    #   Interface
+    #
+    def run( self ) -> bool:
+        walked = 0
+        for page in self.forum.pages:
+            cursor = self.cursors.setdefault( page, Cursor() )
+
+            while not cursor.done and walked < self.pages:
+                if not self._step( page, cursor ):
+                    return False
+                walked += 1
+
+        return True
+
+
+    #
+    #   Implementation
+    #
+    def _step( self, page : str, cursor : Cursor ) -> bool:
+        url   = self.forum.page_url( page, cursor.number )
+        posts = self.forum.listing( url, self.budget )
+
+        # Circuit trouble, or the forum is down.
+        if posts is None:
+            return False
+
+        # Past the last page, the forums show nothing, or the last page again.
+        links = { post.link for post in posts }
+        if not links or links == cursor.last:
+            return self._finish( page, cursor, True )
+
+        known = { link for ( link, ) in database.query_database( psql_queries.select_known_links, ( list( links ), ) ) or [] }
+        fresh = [ post for post in posts if post.link not in known ]
+        store_posts( fresh, self.forum.on_new )
+
+        # Every thread on the page is older than wanted.
+        dates = [ post.posted for post in posts if post.posted ]
+        if self.until and dates and max( dates ) < self.until:
+            return self._finish( page, cursor, True )
+
+        # Caught up with the stored threads.
+        if not fresh and ( cursor.history or not self.until ):
+            return self._finish( page, cursor, cursor.history )
+
+        printl( f"[↺] { url }: { len( fresh ) } of { len( posts ) } threads were new." )
+        cursor.number += 1
+        cursor.last    = links
+        self._save( page, cursor )
+        return True
+
+
+    def _finish( self, page : str, cursor : Cursor, history : bool ) -> bool:
+        cursor.done, cursor.history = True, history
+        self._save( page, cursor )
+
+        printl( f"[✓] Backfill of { page } done, at page { cursor.number }." )
+        return True
+
+
+    def _save( self, page : str, cursor : Cursor ):
+        database.insert_data( psql_queries.upsert_cursor, ( self.forum.forum_id, page, cursor.number, cursor.history, cursor.done ) )
+
+
+def as_datetime( value ) -> datetime | None:
+    """
+    TOML dates and datetimes, or ISO strings, as an aware datetime. Naive ones are taken as UTC.
+
+    """
+    if not value:
+        return None
+
+    if isinstance( value, str ):
+        value = datetime.fromisoformat( value )
+
+    if not isinstance( value, datetime ):
+        value = datetime( value.year, value.month, value.day )
+
+    return value if value.tzinfo else value.replace( tzinfo = timezone.utc )
+
+
+#
+#   SQL Queries for the backfill
+#
+class psql_queries:
+
+    # Selects
+    select_cursors = """ SELECT page, number, history, done FROM BackfillCursor WHERE forum_id = %s ;"""
+    """ SELECT page, number, history, done; forum_id """
+
+    select_known_links = """ SELECT link FROM ForumPost WHERE link = ANY( %s ) ;"""
+    """ SELECT link; [link, ...] """
+
+    # Inserts
+    upsert_cursor = """
+    INSERT INTO BackfillCursor (forum_id, page, number, history, done) VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (forum_id, page) DO UPDATE SET
+        number = EXCLUDED.number, history = EXCLUDED.history, done = EXCLUDED.done, updated_at = now();
+    """
+    """forum_id, page, number, history, done"""
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
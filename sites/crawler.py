@@ -0,0 +1,150 @@
+"""
+*   Second stage: fetches the first post of newly discovered threads, and stores it as their content.
+"""
+import queue, threading, time
+from datetime import datetime
+
+from database.psql import main as database
+from scheduler.budget import FetchBudget
+
+
+# Global Variables
+MAX_QUEUED  = 1000   # Threads waiting for their content at most, per forum.
+CONCURRENCY = 2      # Threads fetched at once, per forum.
+PER_MINUTE  = 30     # Threads fetched per minute at most, per forum.
+BATCH       = 20     # Contents stored in one transaction at most.
+FLUSH       = 10.0   # Seconds a content waits for others to join its transaction.
+
+
+class ContentCrawler:
+    """
+    Fetches the first post of a forum's new threads. Only threads the database
+    reported as new are enqueued, each link once, and the update only fills
+    empty contents, so a thread is fetched a single time however often it is
+    listed. Fetches are bounded by `concurrency` and a per-forum rate limit, on
+    top of the global fetch budget, and the contents are stored in batches.
+
+    When the queue is full, new threads are left without content rather than
+    holding up the scraper.
+
+    Interface:
+        ContentCrawler(name, fetch, parse, concurrency=CONCURRENCY, per_minute=PER_MINUTE, max_queued=MAX_QUEUED)
+            - fetch(url) -> html of the thread, None on failure.
+            - parse(html) -> content of the first post, None if it isn't there.
+
+        ContentCrawler.enqueue(posts)
+            - queue the content of the posts for fetching.
+    """
+
+    def __init__( self, name : str, fetch, parse, concurrency : int = CONCURRENCY, per_minute : int = PER_MINUTE, max_queued : int = MAX_QUEUED ):
+        self.name    : str         = name
+        self.fetch                 = fetch
+        self.parse                 = parse
+        self.rate    : FetchBudget = FetchBudget( per_minute )
+
+        self.queue   : queue.Queue = queue.Queue( maxsize = max_queued )
+        self.queued  : set[str]    = set()   # Links queued or in flight.
+        self.pending : list[tuple] = []      # (content, link) waiting to be stored.
+        self.flushed : float       = time.monotonic()
+        self.lock    = threading.Lock()
+
+        for number in range( max( 1, concurrency ) ):
+            threading.Thread( target = self._run, name = f"content-{ name }-{ number }", daemon = True ).start()
+        threading.Thread( target = self._flusher, name = f"content-{ name }-flush", daemon = True ).start()
+
+
+    @classmethod
+    def from_config( cls, name : str, fetch, parse, config : dict ) -> "ContentCrawler":
+        return cls(
+            name, fetch, parse,
+            concurrency = config.get( "content_concurrency", CONCURRENCY ),
+            per_minute  = config.get( "content_per_minute",  PER_MINUTE ),
+            max_queued  = config.get( "content_queue",       MAX_QUEUED ),
+        )
+
+
+    #
+    #   Interface
+    #
+    def enqueue( self, posts : list ):
+        dropped = 0
+        for post in posts:
+            with self.lock:
+                if post.link in self.queued:
+                    continue
+                self.queued.add( post.link )
+
+            try:
+                self.queue.put_nowait( post.link )
+
+            except queue.Full:
+                with self.lock:
+                    self.queued.discard( post.link )
+                dropped += 1
+
+        if dropped:
+            printl( f"[!] Content queue of { self.name } is full, { dropped } threads left without content." )
+
+
+    #
+    #   Implementation
+    #
+    def _run( self ):
+        while True:
+            link = self.queue.get()
+            try:
+                self.rate.acquire()
+                html    = self.fetch( link )
+                content = self.parse( html ) if html else None
+
+                if content:
+                    self._add( content, link )
+
+            except Exception as e:
+                printl( f"[!] Could not get the content of { link }: { e }" )
+
+            finally:
+                with self.lock:
+                    self.queued.discard( link )
+
+
+    def _add( self, content : str, link : str ):
+        with self.lock:
+            self.pending.append(( content, link ))
+            if len( self.pending ) < BATCH:
+                return
+
+        self._flush()
+
+
+    def _flusher( self ):
+        while True:
+            time.sleep( FLUSH )
+            if time.monotonic() - self.flushed >= FLUSH:
+                self._flush()
+
+
+    def _flush( self ):
+        with self.lock:
+            batch, self.pending = self.pending, []
+            self.flushed = time.monotonic()
+
+        if batch:
+            database.update_data( psql_queries.update_post_content, batch )
+
+
+#
+#   SQL Queries for the content crawler
+#
+class psql_queries:
+
+    # Updates
+    update_post_content = """
+    UPDATE ForumPost SET content = %s WHERE link = %s AND content IS NULL;
+    """
+    """content, link"""
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
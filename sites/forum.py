@@ -1,6 +1,16 @@
-from dataclasses import dataclass
+import threading
+from collections  import OrderedDict
+from dataclasses  import dataclass
+from datetime     import datetime
+from urllib.parse import urlsplit, urlunsplit
 
-from database.psql import main as database
+from database.psql import main as database, writer
+
+
+# Global Variables
+WRITER    : writer.WriteBehind = None   # Background writer of the posts, started by Forums().
+SEEN_SIZE : int                = 10000  # Links remembered per forum.
+ON_NEW    : dict               = {}     # forum_id -> on_new of its posts, for the ones the writer replays.
 
 
 @dataclass(slots = True)
@@ -8,19 +18,194 @@ class ForumPost:
     link:      str
     title:     str
     content:   str
-    timestamp: str
+    timestamp: str                 # As the forum shows it.
     forum_id:  str
+    posted:    datetime = None     # The timestamp normalized to UTC, see sites.timestamps.
+
+
+def store_posts( posts : list[ForumPost], on_new = None, on_stored = None ):
+    """
+    Stores the posts, skipping the ones already stored. Handed to the background
+    writer when it is running, so the caller doesn't wait on the database.
+
+    Optional args:
+        on_new (callable): called with the posts that were new, once they are stored.
+                           Kept per forum, for the posts the writer spills and replays later.
+        on_stored (callable): called once the posts are stored, not when they are spilled.
+    """
+    # Posts missing the required columns would fail the whole batch.
+    posts = [ post for post in posts if post.link and post.title ]
+    rows  = [ ( post.link, post.title, post.content, post.timestamp, post.forum_id, post.posted.isoformat() if post.posted else None ) for post in posts ]
+    
+    def stored( returned : list ):
+        fresh = new_posts( posts, returned )
+        if on_new and fresh:
+            on_new( fresh )
+        
+        if on_stored:
+            on_stored()
+    
+    if WRITER:
+        for forum_id in { post.forum_id for post in posts if on_new }:
+            ON_NEW[forum_id] = on_new
+        
+        WRITER.put( rows, stored, posts[0].forum_id if posts else None )
+        return
+    
+    returned = database.insert_many( psql_queries.insert_forum_posts, rows )
+    if returned is not False:
+        stored( returned )
+
+
+def replayed( forum_id, rows : list[tuple], returned : list ):
+    """
+    on_replay of the writer: the spilled rows of a forum were written at last.
+
+    """
+    on_new = ON_NEW.get( forum_id )
+    posts  = [ ForumPost( *row[:5], datetime.fromisoformat( row[5] ) if len( row ) > 5 and row[5] else None ) for row in rows ]
+    fresh  = new_posts( posts, returned )
+    if on_new and fresh:
+        on_new( fresh )
+
+
+def new_posts( posts : list[ForumPost], returned : list ) -> list[ForumPost]:
+    """
+    The posts the insert returned, as (id, link), i.e. those that were new.
+
+    """
+    # A post listed twice in the batch is new only once.
+    new, fresh = { link for _, link in returned }, []
+    for post in posts:
+        if post.link in new:
+            new.discard( post.link )
+            fresh.append( post )
+    
+    return fresh
+
+
+class SeenPosts:
+    """
+    Bounded LRU of the links of a forum's stored posts, warmed from the database,
+    so that the posts seen on every poll are dropped before they reach it.
+    Links are normalized, see `SeenPosts.normalize()`.
+
+    Interface:
+        SeenPosts(forum_id, size=SEEN_SIZE)
+            - warmed with the forum's latest stored links.
+
+        SeenPosts.unseen(posts) -> list[ForumPost]
+            - the posts not seen yet. They count as seen from now on.
+    """
+
+    def __init__( self, forum_id : int, size : int = SEEN_SIZE ):
+        self.size  : int         = size
+        self.links : OrderedDict = OrderedDict() # Normalized link -> None, least recently seen first.
+        self.lock  = threading.Lock()
+
+        rows = database.query_database( psql_queries.select_latest_links, ( forum_id, size ) ) or []
+        for ( link, ) in reversed( rows ):
+            self.links[ self.normalize( link ) ] = None
+
+
+    def unseen( self, posts : list[ForumPost] ) -> list[ForumPost]:
+        fresh = []
+        with self.lock:
+            for post in posts:
+                if not post.link:
+                    continue
+
+                link = self.normalize( post.link )
+                if link in self.links:
+                    self.links.move_to_end( link )
+                    continue
+
+                self.links[link] = None
+                fresh.append( post )
+
+            while len( self.links ) > self.size:
+                self.links.popitem( last = False )
+
+        return fresh
+
+
+    @staticmethod
+    def normalize( link : str ) -> str:
+        # Case-insensitive host, no fragment, no doubled or trailing slashes.
+        parts = urlsplit( link.strip() )
+        path  = "/".join( part for part in parts.path.split( "/" ) if part )
+        return urlunsplit(( parts.scheme.lower(), parts.netloc.lower(), "/" + path, parts.query, "" ))
+
+
+class HighWaterMarks:
+    """
+    Newest thread id seen on each listing page of a forum, kept in the ListingMark
+    table so that it survives restarts. Threads at or below the mark of their page
+    have been seen, and the parsers skip them without building posts.
+
+    Interface:
+        HighWaterMarks(forum_id)
+            - loads the forum's marks.
+
+        HighWaterMarks.get(page) -> int
+            - mark of the page, 0 if it has none yet.
+
+        HighWaterMarks.advance(page, mark)
+            - raise the mark of the page.
+
+        HighWaterMarks.save(page, mark)
+            - store the mark of the page. Call it once the posts below the mark are
+              stored, see store_posts(), or a kill loses them for good.
+    """
+
+    def __init__( self, forum_id : int ):
+        self.forum_id : int            = forum_id
+        self.marks    : dict[str, int] = dict( database.query_database( psql_queries.select_listing_marks, ( forum_id, ) ) or [] )
+        self.saved    : dict[str, int] = dict( self.marks ) # Marks as stored.
+        self.lock     = threading.Lock()
+
+
+    def get( self, page : str ) -> int:
+        with self.lock:
+            return self.marks.get( page, 0 )
+
+
+    def advance( self, page : str, mark : int ):
+        with self.lock:
+            if mark > self.marks.get( page, 0 ):
+                self.marks[page] = mark
+
+
+    def save( self, page : str, mark : int ):
+        with self.lock:
+            if mark <= self.saved.get( page, 0 ):
+                return
+            self.saved[page] = mark
+
+        database.insert_data( psql_queries.upsert_listing_mark, ( self.forum_id, page, mark ) )
 
 
 class Forums:
-    def __init__( self ):
+    def __init__( self, config : dict = None ):
+        global WRITER
         self.storage : list = []
         
         # Add required tables for storing the scraped forum data.
         database.create_tables({ 
-            "Forums"    : psql_queries.create_forums_table,
-            "ForumPost" : psql_queries.create_forumposts_table
+            "Forums"         : psql_queries.create_forums_table,
+            "ForumPost"      : psql_queries.create_forumposts_table,
+            "ListingMark"    : psql_queries.create_listingmarks_table,
+            "BackfillCursor" : psql_queries.create_backfillcursors_table,
+        })
+        
+        # Tables from before the columns they have now.
+        database.migrate_tables({
+            "ForumPost"      : psql_queries.migrate_forumposts_table,
         })
+        
+        # Posts are written in the background, see database.psql.writer.
+        if WRITER is None:
+            WRITER = writer.WriteBehind.from_config( psql_queries.insert_forum_posts, config or {}, on_replay = replayed )
     
     def __iter__(self):
         for forum in self.storage:
@@ -50,7 +235,8 @@ class psql_queries:
             link       TEXT NOT NULL,                   -- URL for the forum post
             title      TEXT NOT NULL,                   -- The title of the forum post
             content    TEXT,                            -- Content from the forum post
-            timestamp  TEXT,                            -- Timestamp from the forum post
+            timestamp  TEXT,                            -- Timestamp from the forum post, as the forum shows it
+            posted_at  TIMESTAMPTZ,                     -- The timestamp, normalized. NULL if it couldn't be read
             
             
             forum_id   INTEGER NOT NULL,                -- 
@@ -62,11 +248,62 @@ class psql_queries:
         ADD CONSTRAINT forumpost_link_unique UNIQUE (link);
         """
 
+    migrate_forumposts_table = """
+        ALTER TABLE ForumPost ADD COLUMN IF NOT EXISTS posted_at TIMESTAMPTZ;
+        CREATE INDEX IF NOT EXISTS forumpost_posted_at ON ForumPost (posted_at);
+    """
+
+
+    create_listingmarks_table = """
+        CREATE TABLE IF NOT EXISTS ListingMark (
+            forum_id   INTEGER NOT NULL,                -- forum of the listing page
+            page       TEXT NOT NULL,                   -- url of the listing page
+            mark       BIGINT NOT NULL,                 -- newest thread id seen on the page
+
+            PRIMARY KEY (forum_id, page),
+            CONSTRAINT fk_forum FOREIGN KEY (forum_id) REFERENCES forums(id)
+        );
+    """
+
+
+    create_backfillcursors_table = """
+        CREATE TABLE IF NOT EXISTS BackfillCursor (
+            forum_id   INTEGER NOT NULL,                -- forum of the listing page
+            page       TEXT NOT NULL,                   -- url of the listing page
+            number     INTEGER NOT NULL,                -- next page of its pagination to fetch
+            history    BOOLEAN NOT NULL DEFAULT FALSE,  -- whether its history was walked before
+            done       BOOLEAN NOT NULL DEFAULT FALSE,  -- whether the current walk is over
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+            PRIMARY KEY (forum_id, page),
+            CONSTRAINT fk_forum FOREIGN KEY (forum_id) REFERENCES forums(id)
+        );
+    """
+
 
     # Selects
     select_forum_id_by_url = """ SELECT id FROM Forums WHERE baseurl LIKE %s ORDER BY id DESC LIMIT 1 ;"""
     """ SELECT id; %s = '%url.netloc%' """
 
+    select_listing_marks = """ SELECT page, mark FROM ListingMark WHERE forum_id = %s ;"""
+    """ SELECT page, mark; forum_id """
+
+    select_latest_links = """ SELECT link FROM ForumPost WHERE forum_id = %s ORDER BY id DESC LIMIT %s ;"""
+    """ SELECT link; forum_id, limit """
+
     # Inserts
+    upsert_listing_mark = """
+    INSERT INTO ListingMark (forum_id, page, mark) VALUES (%s, %s, %s)
+    ON CONFLICT (forum_id, page) DO UPDATE SET mark = GREATEST( ListingMark.mark, EXCLUDED.mark );
+    """
+    """forum_id, page, mark"""
+
     insert_into_forums = """INSERT INTO Forums (type, baseurl) VALUES (%s, %s);"""
     """type, baseurl"""
+
+    insert_forum_posts = """
+    INSERT INTO ForumPost (link, title, content, timestamp, forum_id, posted_at) VALUES %s
+    ON CONFLICT (link) DO NOTHING
+    RETURNING id, link;
+    """
+    """[(link, title, content, timestamp, forum_id, posted_at), ...]"""
@@ -2,14 +2,22 @@
  *   Type for all 'Breach' type sites.
 """
 from bs4          import BeautifulSoup
-from dataclasses  import dataclass
+from dataclasses  import dataclass, replace
 
-import tor.manager, scraper.browser
-from sites.forum  import ForumPost
+import tor.manager, scraper.browser, scraper.fetch, scraper.parsing, scheduler.adaptive
+import sites.timestamps
+from sites.crawler import ContentCrawler
+from sites.forum  import ForumPost, SeenPosts, SEEN_SIZE, store_posts
 
 from database.psql import main as database
 
 
+# Global Variables
+LISTING = scraper.parsing.strainer( "div", "lp-item" ) # The only part of the page parsed.
+CONTENT = scraper.parsing.strainer( "div", "post_body" ) # Post bodies, the first one is the thread's content.
+FORMATS = ( "%m-%d-%Y, %I:%M %p", "%d-%m-%Y, %I:%M %p", "%m-%d-%Y", "%d-%m-%Y" ) # MyBB's own formats, month first as in its default.
+
+
 #
 #   BreachForums object  
 #
@@ -23,16 +31,38 @@ class Breachforums:
                 
             Breachforums.monitor()
                 - fetch latest posts from the forum. Use this in a loop.
+            
+            Breachforums.poll(pages) -> list[str]
+                - fetch the latest posts from the front page now, see `Breachforums.pages`.
+                - returns the pages that could be fetched.
     
     """
     
-    def __init__( self, url : str, manager : tor.manager.Manager, proxy : str = "socks5://127.0.0.1:9050" ):
-        self.url     : str                 = url     # Base url for the forum.
-        self.proxy   : str                 = proxy   # Proxy the scraper is going to use. Should be the Tor proxy the circuit manager is connected to.
-        self.manager : tor.manager.Manager = manager # Tor circuit manager. 
+    ready_selector : str = "div.lp-item" # The listing is there, the page can be parsed.
+    
+    def __init__( self, url : str, manager : tor.manager.Manager, config : dict = None ):
+        self.url     : str                 = url          # Base url for the forum.
+        self.manager : tor.manager.Manager = manager      # Tor circuit manager. Picks the proxy (circuit) each fetch goes through.
+        self.config  : dict                = config or {} # The forum's table from config.toml.
         
         self.status   : bool = False   # Whether or not this site is currently being tracked
         self.forum_id : int  = -1
+        self.strategy : str  = self.config.get( "fetch_strategy", "auto" ) # "auto", "http" or "browser", see scraper.fetch.
+        self.parser   : str  = self.config.get( "parser", scraper.parsing.DEFAULT ) # "lxml" or "html.parser", see scraper.parsing.
+        self.zone     : str  = self.config.get( "timezone", "UTC" ) # Time zone of the forum's timestamps, see sites.timestamps.
+        self.policy   : scraper.browser.NavigationPolicy = scraper.browser.NavigationPolicy.from_config( self.config, self.ready_selector )
+        
+        # Unknown time zones fail here, rather than in every parse.
+        sites.timestamps.get_zone( self.zone )
+        
+        # Time-sensitive forums get the fastest circuit.
+        if self.config.get( "latency_sensitive", False ):
+            self.manager.prefer_fastest( self.url )
+        
+        # The front page is polled as often as its activity calls for.
+        self.pages    : list[str] = [ self.url ]
+        self.poller   : scheduler.adaptive.AdaptivePoller = scheduler.adaptive.AdaptivePoller.from_config( self.config )
+        self.interval : float = self.poller.min_interval # How often the monitor runs, the front page is polled when due.
         
         # Try to get the forum_id. If forum doesn't exist, add it.
         try:
@@ -40,80 +70,91 @@ class Breachforums:
         except IndexError:
             database.insert_data( psql_queries.insert_into_forums, ("Breachforums", self.url) )
             self.forum_id = database.query_database( psql_queries.select_forum_by_id, (f"%{self.url}%",) )[0][0] # The forum ID in the database.
+        
+        # Links already stored, only new posts go to the database.
+        self.seen = SeenPosts( self.forum_id, self.config.get( "seen_size", SEEN_SIZE ) )
+        
+        # New threads get their first post fetched, in the background. With a breaker of
+        # their own, and no ready selector: a deleted thread has no post body, which must
+        # not pass for a JavaScript wall nor a timeout. Challenges are still caught, see scraper.client.
+        self.content_key    : str = f"{ self.url }#content"
+        self.content_policy : scraper.browser.NavigationPolicy = replace( self.policy, ready_selector = None )
+        self.crawler        : ContentCrawler = ContentCrawler.from_config( self.url, self._fetch_content, self._parse_content, self.config ) if self.config.get( "fetch_content", True ) else None
     
     
     #
     #   Interface
     #
     def monitor( self ) -> bool:    
+        # Front page not due for a poll yet.
+        if not self.poller.due( self.pages ):
+            return True
+        
+        return bool( self.poll( self.pages ) )
+    
+    
+    def poll( self, pages : list[str] ) -> list[str]:
         # Use a scraper to get the front page html.
         html = self._fetch_frontpage()
         
         # Could not fetch site despite best efforts. Mark as inactive.
         if not html:
             self.status = False
-            return False
+            return []
         
         # Get the latest posts of BreachForums
         latest_posts = self._parse_latest( self.url + "//", html )
+        self.poller.observe( self.url, [ post.link for post in latest_posts ] )
         
         # Site down?
         if not latest_posts:
             self.status = False
-            return False
+            return []
         
-        self._store_posts(latest_posts)
-        self._print_posts(latest_posts)
+        # Store, the new posts are logged once written
+        self._store_posts( latest_posts )
         
         self.status = True        
-        return True
+        return self.pages
     
     
     #
     #   Implementation
     #
     def _parse_latest( self, url, html ):
-        posts : list          = []        
-        soup  : BeautifulSoup = BeautifulSoup( html, "html.parser" )
-        
-        # Go through the latest posts
-        for item in soup.select("div.lp-item"):
-
-            # Get the title and link to the post from the <a> tag
-            a_tag = item.select_one( "a.lp-title" )
-            
-            title     = self._clean_str( a_tag.text )
-            href      = a_tag.get( "href" )
-            
-            # Filter the spans within title. First one should be the forum post timestamp.
-            timestamp = item.select_one("span[title]").get("title")
-            
-            # TODO: Get content as well!
-            posts.append( ForumPost(
-                link      = url + href,
-                title     = title,
-                content   = None,  
-                timestamp = timestamp,
-                forum_id  = self.forum_id
-            ))
-        
-        return posts
+        rows = scraper.parsing.run_all( parse_latest, [ ( html, url, self.forum_id, self.parser, self.zone ) ] )[0]
+        return [ ForumPost( *row ) for row in rows ]
+    
+    
+    def _fetch_content( self, url : str ) -> str | None:
+        html = self.manager.fetch( 
+            self.content_key, scraper.fetch.fetch,  # forum's content, function call
+            url, self.strategy, self.content_policy # function arguments
+        )
+        return html or None
+    
+    
+    def _parse_content( self, html : str ) -> str | None:
+        return scraper.parsing.run_all( parse_content, [ ( html, self.parser ) ] )[0]
     
     
     def _fetch_frontpage( self ) -> str | None:
-        html = self.manager.execute_function( 
-            scraper.browser.open,             # function call
-            self.url, self.proxy              # function arguments
+        html = self.manager.fetch( 
+            self.url, scraper.fetch.fetch,       # forum, function call
+            self.url, self.strategy, self.policy # function arguments
         )
         return html or None
 
     
     def _store_posts( self, posts: list[ ForumPost ] ):
-        for post in posts: 
-            database.insert_data(
-                psql_queries.insert_into_forum_post,
-                ( post.link, post.title, post.content, post.timestamp, self.forum_id )
-            )
+        store_posts( self.seen.unseen( posts ), self._on_new ) # The new ones are handled once written.
+    
+    
+    def _on_new( self, posts: list[ ForumPost ] ):
+        self._print_posts( posts )
+        
+        if self.crawler:
+            self.crawler.enqueue( posts )
     
     
     def _print_posts( self, posts: list[ ForumPost ]):
@@ -121,10 +162,56 @@ class Breachforums:
             print( f"\n{'-'*43}" + f"\nTitle:\t\t{post.title}" + f"\nLink:\t\t{post.link}" + f"\nTimestamp:\t{post.timestamp}" )    
     
     
-    def _clean_str( self, string ): return str(string).strip('\n').strip('  ').strip('\t').replace("\n","") 
+    def _clean_str( self, string ): return clean_str( string )
     def __str__( self ): return f"{self.url}" 
     
 
+#
+#   Parsing, runs in the parse pool
+#
+def parse_latest( html : str, url : str, forum_id : int, backend : str = scraper.parsing.DEFAULT, zone : str = "UTC" ) -> list[tuple]:
+    """
+    Parses the latest posts on the front page, as ForumPost fields.
+    Runs in the parse pool, so it takes and returns plain data only.
+    
+    """
+    posts : list          = []        
+    soup  : BeautifulSoup = scraper.parsing.parse( html, backend, LISTING )
+    
+    # Go through the latest posts
+    for item in soup.select("div.lp-item"):
+
+        # Get the title and link to the post from the <a> tag
+        a_tag = item.select_one( "a.lp-title" )
+        
+        title     = clean_str( a_tag.text )
+        href      = a_tag.get( "href" )
+        
+        # Filter the spans within title. First one should be the forum post timestamp.
+        # <span title="12-25-2025, 09:39 PM">5 minutes ago</span>
+        span      = item.select_one("span[title]")
+        timestamp = span.get("title")
+        posted    = sites.timestamps.normalize( timestamp, FORMATS, zone ) or sites.timestamps.normalize( span.get_text(), FORMATS, zone )
+        
+        # link, title, content, timestamp, forum_id, posted
+        posts.append(( url + href, title, None, timestamp, forum_id, posted ))
+    
+    return posts
+
+
+def clean_str( string ): return str(string).strip('\n').strip('  ').strip('\t').replace("\n","") 
+
+
+def parse_content( html : str, backend : str = scraper.parsing.DEFAULT ) -> str | None:
+    """
+    Parses the content of a thread, the text of its first post.
+    
+    """
+    # MyBB: <div class="post_body scaleimages" id="pid_123">
+    body = scraper.parsing.parse( html, backend, CONTENT ).select_one( "div.post_body" )
+    return body.get_text( "\n", strip = True ) if body else None
+
+
 #
 #   Required SQL Queries
 #
@@ -147,10 +234,3 @@ class psql_queries:
     INSERT INTO Forums (type, baseurl) VALUES (%s, %s);
     """
     """type, baseurl"""
-    
-    insert_into_forum_post = """
-    INSERT INTO ForumPost (
-        link, title, content, timestamp, forum_id
-    ) VALUES ( %s, %s, %s, %s, %s );
-    """
-    """ link, title, content, timestamp, forum_id """
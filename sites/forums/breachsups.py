@@ -1,15 +1,25 @@
 """
  *   Type for all 'Breach' type sites.
 """
+import functools, re
 from bs4          import BeautifulSoup
-from dataclasses  import dataclass
+from dataclasses  import dataclass, replace
+from typing       import Iterator
 
-import tor.manager, scraper.browser
-from sites.forum  import ForumPost
+import tor.manager, scraper.browser, scraper.fetch, scraper.parsing, scheduler.adaptive, scheduler.budget
+import sites.timestamps
+from sites.crawler import ContentCrawler
+from sites.forum  import ForumPost, HighWaterMarks, SeenPosts, SEEN_SIZE, store_posts
 
 from database.psql import main as database
 
 
+# Global Variables
+LISTING = scraper.parsing.strainer( "div", "structItem--thread" ) # The only part of the page parsed.
+CONTENT = scraper.parsing.strainer( "div", "bbWrapper" ) # Post bodies, the first one is the thread's content.
+FORMATS = ( "%b %d, %Y", "%b %d, %Y at %I:%M %p" )   # Timestamps shown as text, e.g. "Dec 25, 2025". Usually the datetime attribute is there.
+
+
 #
 #   BreachForums object  
 #
@@ -23,16 +33,57 @@ class Breachsups:
                 
             Breachforums.monitor()
                 - fetch latest posts from the forum. Use this in a loop.
+            
+            Breachforums.poll(pages) -> list[str]
+                - fetch the latest posts of the given listing pages now, see `Breachforums.pages`.
+                - returns the pages that could be fetched.
+            
+            Breachforums.listing(url, budget=None) -> list[ForumPost] | None
+                - fetch and parse every thread of a listing page, None if it couldn't be fetched.
+                - spends `budget` instead of the manager's, see tor.manager.Manager.fetch().
+            
+            Breachforums.page_url(page, number) -> str
+                - url of a page of the pagination of a listing page, see `sites.backfill`.
+            
+            Breachforums.on_new(posts)
+                - handle the posts that were new once stored: printed, and their content fetched.
     
     """
     
-    def __init__( self, url : str, manager : tor.manager.Manager, proxy : str = "socks5://127.0.0.1:9050" ):
-        self.url     : str                 = url     # Base url for the forum.
-        self.proxy   : str                 = proxy   # Proxy the scraper is going to use. Should be the Tor proxy the circuit manager is connected to.
-        self.manager : tor.manager.Manager = manager # Tor circuit manager. 
+    ready_selector : str = "div.structItem--thread" # The listing is there, the page can be parsed.
+    
+    def __init__( self, url : str, manager : tor.manager.Manager, config : dict = None ):
+        self.url     : str                 = url          # Base url for the forum.
+        self.manager : tor.manager.Manager = manager      # Tor circuit manager. Picks the proxy (circuit) each fetch goes through.
+        self.config  : dict                = config or {} # The forum's table from config.toml.
+        
+        self.status      : bool = False   # Whether or not this site is currently being tracked
+        self.forum_id    : int  = -1
+        self.concurrency : int  = self.config.get( "max_concurrency", 4 ) # Pages fetched at once.
+        self.strategy    : str  = self.config.get( "fetch_strategy", "auto" ) # "auto", "http" or "browser", see scraper.fetch.
+        self.parser      : str  = self.config.get( "parser", scraper.parsing.DEFAULT ) # "lxml" or "html.parser", see scraper.parsing.
+        self.zone        : str  = self.config.get( "timezone", "UTC" ) # Time zone of the forum's timestamps, see sites.timestamps.
+        self.policy      : scraper.browser.NavigationPolicy = scraper.browser.NavigationPolicy.from_config( self.config, self.ready_selector )
+        
+        # Unknown time zones fail here, rather than in every parse.
+        sites.timestamps.get_zone( self.zone )
+        
+        # Time-sensitive forums get the fastest circuit.
+        if self.config.get( "latency_sensitive", False ):
+            self.manager.prefer_fastest( self.url )
         
-        self.status   : bool = False   # Whether or not this site is currently being tracked
-        self.forum_id : int  = -1
+        # Listing pages to monitor, each polled as often as its activity calls for.
+        self.pages    : list[str] = [
+            self.url + "/index.php?forums/databases.14/",        # Databases
+            self.url + "/index.php?forums/stealer-logs.15/",     # Stealer Logs
+            self.url + "/index.php?forums/other-leaks.16/",      # Other leaks
+            self.url + "/index.php?forums/cracked-accounts.18/", # Cracked Accounts
+            self.url + "/index.php?forums/combolists.19/",       # Combolists
+            self.url + "/index.php?forums/sellers-place.24/",    # Sellers
+            self.url + "/index.php?forums/buyers-place.25/",     # Buyers
+        ]
+        self.poller   : scheduler.adaptive.AdaptivePoller = scheduler.adaptive.AdaptivePoller.from_config( self.config )
+        self.interval : float = self.poller.min_interval # How often the monitor runs, only due pages are polled.
         
         # Try to get the forum_id. If forum doesn't exist, add it.
         try:
@@ -40,118 +91,124 @@ class Breachsups:
         except IndexError:
             database.insert_data( psql_queries.insert_into_forums, ("Breachsups", self.url) )
             self.forum_id = database.query_database( psql_queries.select_forum_by_id, (f"%{self.url}%",) )[0][0] # The forum ID in the database.
+        
+        # Links already stored, only new posts go to the database.
+        self.seen  = SeenPosts( self.forum_id, self.config.get( "seen_size", SEEN_SIZE ) )
+        self.marks = HighWaterMarks( self.forum_id ) # Newest thread id per listing page.
+        
+        # New threads get their first post fetched, in the background. With a breaker of
+        # their own, and no ready selector: a deleted thread has no post body, which must
+        # not pass for a JavaScript wall nor a timeout. Challenges are still caught, see scraper.client.
+        self.content_key    : str = f"{ self.url }#content"
+        self.content_policy : scraper.browser.NavigationPolicy = replace( self.policy, ready_selector = None )
+        self.crawler        : ContentCrawler = ContentCrawler.from_config( self.url, self._fetch_content, self._parse_content, self.config ) if self.config.get( "fetch_content", True ) else None
     
     
     #
     #   Interface
     #
     def monitor( self ) -> bool:    
-        status            = False
-        page_html_storage = []
-        
-        # Get each page of forums:
-        interested_pages = [
-            self.url + "/index.php?forums/databases.14/",        # Databases
-            self.url + "/index.php?forums/stealer-logs.15/",     # Stealer Logs
-            self.url + "/index.php?forums/other-leaks.16/",      # Other leaks
-            self.url + "/index.php?forums/cracked-accounts.18/", # Cracked Accounts
-            self.url + "/index.php?forums/combolists.19/",       # Combolists
-            self.url + "/index.php?forums/sellers-place.24/",    # Sellers
-            self.url + "/index.php?forums/buyers-place.25/",     # Buyers
-        ]
-        
+        # Only the pages due for a poll.
+        pages = self.poller.due( self.pages )
+        if not pages:
+            return True
         
-        # Scrape the HTML
-        for page in interested_pages:
-            page_html_storage.append(
-                self._fetch_page( page )
-            )
+        self.poll( pages )
+        return True
+    
+    
+    def poll( self, pages : list[str] ) -> list[str]:
+        status            = False
+        polled            = []
         
-        # -> Parse HTML    
-        for page in page_html_storage:
-                posts = self._parse_posts( page )
+        # Scrape the HTML, concurrently. Each page is handled as soon as it arrives.
+        for url, page in self._fetch_pages( pages ):
+                if not page:
+                    continue
+                
+                polled.append( url )
+                
+                # -> Parse HTML, in the parse pool. Only the threads past the page's high-water mark.
+                posts, newest = self._parse_posts([ ( page, self.marks.get( url ) ) ])[0]
+                
+                self.marks.advance( url, newest )
+                self.poller.observe( url, [ post.link for post in posts ] )
                 
-                # Store & Log
-                self._store_posts(posts)
-                self._print_posts(posts)
+                # Store, the new posts are logged once written, and the mark is stored after them.
+                self._store_posts( posts, functools.partial( self.marks.save, url, newest ) )
                 
-                # Mark status as up
-                for _ in posts:
+                # Mark status as up, the listing is there
+                if newest:
                     status = True
-                    continue
         
-        # No posts? Assume dead:
+        # No listings? Assume dead:
         self.status = status        
-        return True
+        return polled
+    
+    
+    def listing( self, url : str, budget : scheduler.budget.FetchBudget = None ) -> list[ ForumPost ] | None:
+        html = self._fetch_page( url, budget )
+        if not html:
+            return None
+        
+        # Every thread, no high-water mark.
+        return self._parse_posts([ ( html, 0 ) ])[0][0]
+    
+    
+    def page_url( self, page : str, number : int ) -> str:
+        # XenForo: /index.php?forums/databases.14/page-2
+        return f"{ page.rstrip( '/' ) }/page-{ number }"
+    
+    
+    def on_new( self, posts: list[ ForumPost ] ):
+        self._print_posts( posts )
+        
+        if self.crawler:
+            self.crawler.enqueue( posts )
     
     
     #
     #   Implementation
     #
-    def _parse_posts( self, html : str ):
-        
-        # Pinned post
+    def _parse_posts( self, pages : list[ tuple[str, int] ] ) -> list[ tuple[ list[ForumPost], int ] ]:
+        """
+        Parses (html, mark) pairs in the parse pool, see `parse_posts()`.
         
-        # Other posts
-        # class="structItem structItem--thread js-inlineModContainer" -> data-author is username
-        # -> div with class structItem-title for title
-        # -> div with class structItem-startDate for timestamp
-        # -> a.href for the link
+        """
+        parsed = scraper.parsing.run_all( parse_posts, [ 
+            ( html, self.url, self.forum_id, self.parser, mark, self.zone ) for html, mark in pages 
+        ])
+        return [ ( [ ForumPost( *row ) for row in rows ], newest ) for rows, newest in parsed ]
+    
+    
+    def _fetch_content( self, url : str ) -> str | None:
+        html = self.manager.fetch( 
+            self.content_key, scraper.fetch.fetch,  # forum's content, function call
+            url, self.strategy, self.content_policy # function arguments
+        )
+        return html or None
     
-        posts: list = []
-        soup: BeautifulSoup = BeautifulSoup(html, "html.parser")
-
-        # Go through thread items
-        for item in soup.select("div.structItem.structItem--thread.js-inlineModContainer"):
-
-            # Title + link
-            title_div = item.select_one("div.structItem-title a")
-            if not title_div:
-                continue
-
-            title = self._clean_str(title_div.get_text(strip=True))
-            href = title_div.get("href")
-
-            # Timestamp
-            time_tag = item.select_one(
-                        "div.structItem-minor li.structItem-startDate time"
-            )
-            if time_tag:
-                timestamp = (
-                    time_tag.get("datetime")        # preferred
-                    or time_tag.get("data-timestamp")
-                    or time_tag.get("title")
-                    or time_tag.get_text(strip=True)
-                )
-
-            posts.append(
-                ForumPost(
-                    link      = self.url + href if href.startswith("/") else href,
-                    title     = title,
-                    content   = None,
-                    timestamp = timestamp or time_tag,
-                    forum_id  = self.forum_id
-                )
-            )
-
-        return posts
-        
-        
     
-    def _fetch_page( self, url : str ) -> str | None:
-        html = self.manager.execute_function( 
-            scraper.browser.open,             # function call
-            url, self.proxy                   # function arguments
+    def _parse_content( self, html : str ) -> str | None:
+        return scraper.parsing.run_all( parse_content, [ ( html, self.parser ) ] )[0]
+    
+    
+    def _fetch_page( self, url : str, budget : scheduler.budget.FetchBudget = None ) -> str | None:
+        html = self.manager.fetch( 
+            self.url, scraper.fetch.fetch,   # forum, function call
+            url, self.strategy, self.policy, # function arguments
+            budget = budget                  # the manager's own by default
         )
         return html or None
 
     
-    def _store_posts( self, posts: list[ ForumPost ] ):
-        for post in posts: 
-            database.insert_data(
-                psql_queries.insert_into_forum_post,
-                ( post.link, post.title, post.content, post.timestamp, self.forum_id )
-            )
+    def _fetch_pages( self, urls : list[str] ) -> Iterator[ tuple[str, str | None] ]:
+        # Every page with its own retries and circuit handling, yielded as it arrives.
+        return scraper.fetch.stream( self._fetch_page, urls, self.concurrency )
+
+    
+    def _store_posts( self, posts: list[ ForumPost ], on_stored = None ):
+        store_posts( self.seen.unseen( posts ), self.on_new, on_stored ) # The new ones are handled once written.
     
     
     def _print_posts( self, posts: list[ ForumPost ]):
@@ -159,10 +216,92 @@ class Breachsups:
             print( f"\n{'-'*43}" + f"\nTitle:\t\t{post.title}" + f"\nLink:\t\t{post.link}" + f"\nTimestamp:\t{post.timestamp}" )    
     
     
-    def _clean_str( self, string ): return str(string).strip('\n').strip('  ').strip('\t').replace("\n","") 
+    def _clean_str( self, string ): return clean_str( string )
     def __str__( self ): return f"{self.url}" 
     
 
+#
+#   Parsing, runs in the parse pool
+#
+def parse_posts( html : str, url : str, forum_id : int, backend : str = scraper.parsing.DEFAULT, mark : int = 0, zone : str = "UTC" ) -> tuple[ list[tuple], int ]:
+    """
+    Parses the threads of a listing newer than `mark`, a thread id.
+    The listing is ordered by last reply, with stickies on top, so older
+    threads are skipped row by row rather than by stopping at the first one.
+    
+    Runs in the parse pool, so it takes and returns plain data only.
+    
+    Returns:
+        tuple: the new posts as ForumPost fields, and the newest thread id on the page (0 without a listing).
+    """
+    
+    # Pinned post
+    
+    # Other posts
+    # class="structItem structItem--thread js-inlineModContainer" -> data-author is username
+    # -> div with class structItem-title for title
+    # -> div with class structItem-startDate for timestamp
+    # -> a.href for the link
+
+    posts: list = []
+    newest: int = 0
+    soup: BeautifulSoup = scraper.parsing.parse( html, backend, LISTING )
+
+    # Go through thread items
+    for item in soup.select("div.structItem.structItem--thread.js-inlineModContainer"):
+
+        # Title + link
+        title_div = item.select_one("div.structItem-title a")
+        if not title_div:
+            continue
+        
+        # Seen territory, nothing more to build.
+        # <a href="/index.php?threads/some-title.12345/">
+        tid    = thread_id( title_div.get("href") or "" )
+        newest = max( newest, tid, mark )
+        if tid and tid <= mark:
+            continue
+
+        title = clean_str(title_div.get_text(strip=True))
+        href = title_div.get("href")
+
+        # Timestamp
+        timestamp = None
+        time_tag = item.select_one(
+                    "div.structItem-minor li.structItem-startDate time"
+        )
+        if time_tag:
+            timestamp = (
+                time_tag.get("datetime")        # preferred
+                or time_tag.get("data-timestamp")
+                or time_tag.get("title")
+                or time_tag.get_text(strip=True)
+            )
+
+        # link, title, content, timestamp, forum_id, posted
+        posts.append(( url + href if href.startswith("/") else href, title, None, timestamp, forum_id, sites.timestamps.normalize( timestamp, FORMATS, zone ) ))
+
+    return posts, newest
+
+
+def thread_id( href : str ) -> int:
+    match = re.search( r"\.(\d+)/?(?:$|[?#])", href )
+    return int( match.group(1) ) if match else 0
+
+
+def clean_str( string ): return str(string).strip('\n').strip('  ').strip('\t').replace("\n","") 
+
+
+def parse_content( html : str, backend : str = scraper.parsing.DEFAULT ) -> str | None:
+    """
+    Parses the content of a thread, the text of its first post.
+    
+    """
+    # XenForo: <article class="message-body"><div class="bbWrapper">
+    body = scraper.parsing.parse( html, backend, CONTENT ).select_one( "div.bbWrapper" )
+    return body.get_text( "\n", strip = True ) if body else None
+
+
 #
 #   Required SQL Queries
 #
@@ -185,10 +324,3 @@ class psql_queries:
     INSERT INTO Forums (type, baseurl) VALUES (%s, %s);
     """
     """type, baseurl"""
-    
-    insert_into_forum_post = """
-    INSERT INTO ForumPost (
-        link, title, content, timestamp, forum_id
-    ) VALUES ( %s, %s, %s, %s, %s );
-    """
-    """ link, title, content, timestamp, forum_id """
@@ -0,0 +1,105 @@
+"""
+*   Normalizes the forums' free-text timestamps into aware datetimes, in UTC.
+"""
+import re
+from datetime  import datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo  import ZoneInfo
+
+
+# Global Variables
+UNITS    = { "second" : 1, "sec" : 1, "minute" : 60, "min" : 60, "hour" : 3600, "hr" : 3600, "day" : 86400, "week" : 604800, "month" : 2592000, "year" : 31536000 }
+WEEKDAYS = ( "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday" )
+JUST_NOW = ( "just now", "now", "a moment ago", "a few seconds ago", "less than a minute ago", "less than 1 minute ago" )
+CLOCKS   = ( "%I:%M %p", "%I:%M%p", "%H:%M" )
+
+AGO      = re.compile( r"^(\d+|an?|one) (second|sec|minute|min|hour|hr|day|week|month|year)s? ago$", re.I ) # "5 minutes ago"
+EPOCH    = re.compile( r"^(?:\d{9,10}|\d{12,13})$" )  # Unix times since 1973, in seconds or milliseconds.
+DAY      = re.compile( r"^(today|yesterday|" + "|".join( WEEKDAYS ) + r")(?:,? (?:at )?(.+))?$", re.I )   # "Yesterday, 09:39 PM", "Monday at 9:39 PM"
+
+
+def normalize( raw : str, formats : tuple = (), zone : str = "UTC", now : datetime = None ) -> datetime | None:
+    """
+    Parses a forum timestamp. Tried in order: unix time, ISO 8601, the relative
+    forms ("5 minutes ago", "Yesterday, 09:39 PM", "Monday at 9:39 PM", ...),
+    then the forum's own strptime `formats`. Times without a zone are in `zone`,
+    the forum's time zone, and the relative ones are counted from `now`.
+
+    Runs in the parse pool, it only takes and returns plain data.
+
+    Returns:
+        datetime: in UTC, None if the timestamp can't be read.
+    """
+    text = " ".join( str( raw or "" ).replace( "\u200b", "" ).split() )
+    if not text:
+        return None
+
+    local = get_zone( zone )
+    now   = ( now or datetime.now( timezone.utc ) ).astimezone( local )
+
+    # data-timestamp="1766698740", or in milliseconds. Shorter numbers (e.g. a year) aren't unix times.
+    if EPOCH.match( text ):
+        seconds = int( text )
+        return datetime.fromtimestamp( seconds / 1000 if len( text ) > 10 else seconds, timezone.utc )
+
+    # datetime="2025-12-25T21:39:00+0000"
+    try:
+        return to_utc( datetime.fromisoformat( text ), local )
+    except ValueError:
+        pass
+
+    # Relative to the time of the parse.
+    if text.lower() in JUST_NOW:
+        return now.astimezone( timezone.utc )
+
+    match = AGO.match( text )
+    if match:
+        count = int( match.group(1) ) if match.group(1).isdigit() else 1
+        return ( now - timedelta( seconds = count * UNITS[ match.group(2).lower() ] ) ).astimezone( timezone.utc )
+
+    match = DAY.match( text )
+    if match:
+        clock = parse_clock( match.group(2) ) if match.group(2) else time()
+        if clock is None:
+            return None
+
+        day = match.group(1).lower()
+        if day == "today":
+            back = 0
+        elif day == "yesterday":
+            back = 1
+        else:
+            back = ( now.weekday() - WEEKDAYS.index( day ) ) % 7 or 7   # The last one before today.
+
+        return datetime.combine( now.date() - timedelta( days = back ), clock, local ).astimezone( timezone.utc )
+
+    # The forum's absolute formats.
+    for format in formats:
+        try:
+            return to_utc( datetime.strptime( text, format ), local )
+        except ValueError:
+            continue
+
+    return None
+
+
+@lru_cache( maxsize = None )
+def get_zone( zone : str ) -> ZoneInfo:
+    """
+    Raises:
+        zoneinfo.ZoneInfoNotFoundError: on an unknown time zone, e.g. a typo in config.toml.
+    """
+    return ZoneInfo( zone )
+
+
+# Helper functions.
+def to_utc( value : datetime, local : ZoneInfo ) -> datetime: return ( value if value.tzinfo else value.replace( tzinfo = local ) ).astimezone( timezone.utc )
+
+
+def parse_clock( text : str ) -> time | None:
+    for format in CLOCKS:
+        try:
+            return datetime.strptime( text, format ).time()
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,36 @@
+"""
+*   Concurrent fetching on the shared fetch threads.
+"""
+import threading, time
+
+import scraper.fetch
+
+
+def test_stream_yields_every_url():
+    urls = [ f"https://forum.example/page/{ number }" for number in range( 10 ) ]
+
+    def func( url ):
+        if url.endswith( "/3" ):
+            raise ConnectionError( "circuit closed" )
+        return url.upper()
+
+    results = dict( scraper.fetch.stream( func, urls, 3 ) )
+
+    assert set( results ) == set( urls )
+    assert results[ urls[3] ] is None
+    assert results[ urls[0] ] == urls[0].upper()
+
+
+def test_stream_leaves_fetch_threads_to_other_forums():
+    # A slow forum with many pages, two at a time.
+    slow = threading.Thread( target = lambda: list( scraper.fetch.stream( lambda url: time.sleep( 0.2 ), [ str( n ) for n in range( 30 ) ], 2 ) ) )
+    slow.start()
+    time.sleep( 0.05 )
+
+    # Another forum's single page goes out right away, not behind the slow forum's queue.
+    started = time.monotonic()
+    list( scraper.fetch.stream( lambda url: url, [ "fast" ], 1 ) )
+    waited  = time.monotonic() - started
+
+    slow.join()
+    assert waited < 0.1
@@ -0,0 +1,167 @@
+"""
+*   The forum parsers against saved pages, compared with the parsers they replaced.
+"""
+from pathlib      import Path
+from urllib.parse import urljoin
+
+import pytest
+from bs4 import BeautifulSoup
+
+import scraper.parsing
+from sites.forums import breach, breachsups, darkforums
+
+
+# Global Variables
+PAGES    = Path( __file__ ).parent / "pages"
+URL      = "https://forum.example"
+FORUM_ID = 1
+
+
+def page( name : str ) -> str: return ( PAGES / name ).read_text( encoding = "utf-8" )
+
+
+#
+#   The parsers as they were, html.parser on the whole page: (link, title, timestamp)
+#
+def baseline_darkforums( html : str ) -> list[tuple]:
+    posts = []
+    soup  = BeautifulSoup( html, "html.parser" )
+
+    table = soup.select_one( "table.forum-display__thread-list.tborder.clear" )
+    if not table:
+        return posts
+
+    for tr in table.select( "tr" ):
+        a = tr.select_one( 'span[id^="tid_"] a[href^="Thread-"]' )
+        if not a:
+            continue
+
+        created_span = tr.select_one( "span.forum-display__thread-date" )
+        timestamp    = created_span.get_text( " ", strip = True ) if created_span else None
+        if timestamp:
+            timestamp = timestamp.replace( "\u200b", "" ).strip()
+
+        posts.append(( urljoin( URL, a.get( "href" ) ), a.get_text( strip = True ), timestamp ))
+
+    return posts
+
+
+def baseline_breachsups( html : str ) -> list[tuple]:
+    posts = []
+    soup  = BeautifulSoup( html, "html.parser" )
+
+    for item in soup.select( "div.structItem.structItem--thread.js-inlineModContainer" ):
+        title_div = item.select_one( "div.structItem-title a" )
+        if not title_div:
+            continue
+
+        href      = title_div.get( "href" )
+        time_tag  = item.select_one( "div.structItem-minor li.structItem-startDate time" )
+        timestamp = time_tag.get( "datetime" ) or time_tag.get( "data-timestamp" ) or time_tag.get( "title" ) or time_tag.get_text( strip = True )
+
+        posts.append(( URL + href if href.startswith( "/" ) else href, breachsups.clean_str( title_div.get_text( strip = True ) ), timestamp ))
+
+    return posts
+
+
+def baseline_breach( html : str ) -> list[tuple]:
+    posts = []
+    soup  = BeautifulSoup( html, "html.parser" )
+
+    for item in soup.select( "div.lp-item" ):
+        a_tag = item.select_one( "a.lp-title" )
+        posts.append(( URL + "//" + a_tag.get( "href" ), breach.clean_str( a_tag.text ), item.select_one( "span[title]" ).get( "title" ) ))
+
+    return posts
+
+
+#
+#   Tests
+#
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_darkforums_listing( backend ):
+    html = page( "darkforums_listing.html" )
+    rows, newest = darkforums.parse_posts( html, URL, FORUM_ID, backend )
+
+    assert [ ( link, title, timestamp ) for link, title, _, timestamp, *_ in rows ] == baseline_darkforums( html )
+    assert len( rows ) == 4
+    assert newest == 62145
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_darkforums_listing_past_mark( backend ):
+    rows, newest = darkforums.parse_posts( page( "darkforums_listing.html" ), URL, FORUM_ID, backend, 62140 )
+
+    assert [ row[1] for row in rows ] == [ "Selling Example Corp customer DB 2.1M rows" ]
+    assert newest == 62145
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_breachsups_listing( backend ):
+    html = page( "breachsups_listing.html" )
+    rows, newest = breachsups.parse_posts( html, URL, FORUM_ID, backend )
+
+    assert [ ( link, title, timestamp ) for link, title, _, timestamp, *_ in rows ] == baseline_breachsups( html )
+    assert len( rows ) == 4
+    assert newest == 12345
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_breachsups_listing_past_mark( backend ):
+    rows, newest = breachsups.parse_posts( page( "breachsups_listing.html" ), URL, FORUM_ID, backend, 12340 )
+
+    assert [ row[1] for row in rows ] == [ "Example Telecom 2025 full dump" ]
+    assert newest == 12345
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_breach_frontpage( backend ):
+    html = page( "breach_frontpage.html" )
+    rows = breach.parse_latest( html, URL + "//", FORUM_ID, backend )
+
+    assert [ ( link, title, timestamp ) for link, title, _, timestamp, *_ in rows ] == baseline_breach( html )
+    assert len( rows ) == 3
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_darkforums_content( backend ):
+    content = darkforums.parse_content( page( "darkforums_thread.html" ), backend )
+
+    assert content.startswith( "Selling the full customer database of Example Corp." )
+    assert "email, name, phone" in content
+    assert "PM sent." not in content
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_breach_content( backend ):
+    content = breach.parse_content( page( "breach_thread.html" ), backend )
+
+    assert content.startswith( "Selling the full customer database of Example Corp." )
+    assert "PM sent." not in content
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_breachsups_content( backend ):
+    content = breachsups.parse_content( page( "breachsups_thread.html" ), backend )
+
+    assert content == "Full dump of Example Telecom, taken December 2025.\nSize:\n40 GB\nPrice in PM."
+
+
+@pytest.mark.parametrize( "backend", scraper.parsing.BACKENDS )
+def test_content_missing( backend ):
+    assert darkforums.parse_content( page( "darkforums_listing.html" ), backend ) is None
+    assert breachsups.parse_content( page( "breachsups_listing.html" ), backend ) is None
+
+
+@pytest.mark.parametrize( "name, selector", [
+    ( "darkforums_listing.html", darkforums.DarkForums.ready_selector ),
+    ( "breachsups_listing.html", breachsups.Breachsups.ready_selector ),
+    ( "breach_frontpage.html",   breach.Breachforums.ready_selector ),
+    ( "breachsups_listing.html", "div.structItem.structItem--thread" ),
+    ( "breach_frontpage.html",   "div.lp-item > a.lp-title" ),
+    ( "breach_frontpage.html",   "div.post_body" ),
+    ( "darkforums_thread.html",  "table.forum-display__thread-list" ),
+])
+def test_ready_selector_present( name, selector ):
+    html = page( name )
+    assert scraper.parsing.present( html, selector ) == ( BeautifulSoup( html, "html.parser" ).select_one( selector ) is not None )
@@ -0,0 +1,53 @@
+"""
+*   The forums' timestamps, normalized to UTC at a fixed time of parse.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from sites import timestamps
+from sites.forums import breach, breachsups, darkforums
+
+
+# Global Variables
+NOW = datetime( 2025, 12, 26, 12, 0, tzinfo = timezone.utc ) # A Friday.
+
+
+def utc( *args ) -> datetime: return datetime( *args, tzinfo = timezone.utc )
+
+
+@pytest.mark.parametrize( "raw, formats, zone, expected", [
+    # Unix times, in seconds or milliseconds. Other numbers aren't.
+    ( "1766698740",                  (),                 "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+    ( "1766698740000",               (),                 "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+    ( "2025",                        (),                 "UTC",              None ),
+    ( "62145",                       (),                 "UTC",              None ),
+
+    # ISO 8601, in the forum's zone unless it has one.
+    ( "2025-12-25T21:39:00+0000",    (),                 "Europe/Berlin",    utc( 2025, 12, 25, 21, 39 ) ),
+    ( "2025-12-25T21:39:00",         (),                 "Europe/Berlin",    utc( 2025, 12, 25, 20, 39 ) ),
+
+    # Relative to the time of the parse.
+    ( "Just now",                    (),                 "UTC",              NOW ),
+    ( "5 minutes ago",               (),                 "UTC",              utc( 2025, 12, 26, 11, 55 ) ),
+    ( "an hour ago",                 (),                 "UTC",              utc( 2025, 12, 26, 11, 0 ) ),
+    ( "2 days ago",                  (),                 "UTC",              utc( 2025, 12, 24, 12, 0 ) ),
+    ( "Yesterday, 09:39 PM",         (),                 "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+    ( "Today at 9:39 AM",            (),                 "America/New_York", utc( 2025, 12, 26, 14, 39 ) ),
+    ( "Monday at 9:39 PM",           (),                 "UTC",              utc( 2025, 12, 22, 21, 39 ) ),
+    ( "Friday",                      (),                 "UTC",              utc( 2025, 12, 19 ) ),
+    ( "Yesterday, 25:99",            (),                 "UTC",              None ),
+
+    # The forums' own formats.
+    ( "\u200b 25-12-25, 09:39 PM",   darkforums.FORMATS, "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+    ( "12-25-2025, 09:39 PM",        breach.FORMATS,     "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+    ( "Dec 25, 2025",                breachsups.FORMATS, "Europe/Berlin",    utc( 2025, 12, 24, 23, 0 ) ),
+    ( "Dec 25, 2025 at 9:39 PM",     breachsups.FORMATS, "UTC",              utc( 2025, 12, 25, 21, 39 ) ),
+
+    # Nothing to read.
+    ( "",                            (),                 "UTC",              None ),
+    ( None,                          (),                 "UTC",              None ),
+    ( "a while back",                darkforums.FORMATS, "UTC",              None ),
+])
+def test_normalize( raw, formats, zone, expected ):
+    assert timestamps.normalize( raw, formats, zone, NOW ) == expected
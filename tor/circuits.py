@@ -0,0 +1,238 @@
+"""
+*   Pool of Tor circuits (SOCKS endpoints) the scrapers are spread over.
+"""
+import threading, time
+from datetime import datetime
+
+from .session import ControlSession
+
+
+# Global Variables
+RENEWAL_LOCK = threading.Lock()
+ALPHA        = 0.3   # Weight of the newest sample in the latency and failure EWMAs.
+MIN_SAMPLES  = 5     # Samples needed before a circuit is judged on its scores.
+
+
+class Circuit:
+    """
+    One Tor SOCKS port, and the control port used to renew it.
+
+    Streams on different SOCKS ports never share a Tor circuit. Circuits of
+    different Tor instances (control ports) are also renewed independently,
+    circuits sharing a control port are renewed together.
+
+    Note: Chromium doesn't support SOCKS5 authentication, so isolation is done
+    with separate SOCKS ports rather than IsolateSOCKSAuth credentials.
+    """
+
+    def __init__( self, socks_port : int = 9050, control_port : int = 9051, host : str = "127.0.0.1", session : ControlSession = None ):
+        self.host         : str            = host
+        self.socks_port   : int            = socks_port
+        self.control_port : int            = control_port
+        self.session      : ControlSession = session or ControlSession( control_port ) # Shared by the circuits of one Tor instance.
+
+        self.proxy  : str      = f"socks5://{ host }:{ socks_port }"
+        self.forums : set[str] = set() # Keys of the forums assigned to this circuit.
+        self.active : int      = 0     # Fetches in flight.
+        
+        self.ready  : threading.Event = threading.Event() # Cleared while the circuit is being renewed.
+        self.ready.set()
+        
+        # Rolling scores of the current exit, reset on renewal.
+        self.latency  : float = None  # EWMA of fetch latency, seconds.
+        self.failures : float = 0.0   # EWMA of the failure rate, 0..1.
+        self.samples  : int   = 0
+
+
+    def record( self, latency : float | None, ok : bool ):
+        """
+        Adds a fetch to the circuit's rolling scores. Latency is optional, as not
+        every fetch (e.g. batches) is comparable.
+
+        """
+        self.samples  += 1
+        self.failures  = ALPHA * ( 0.0 if ok else 1.0 ) + ( 1 - ALPHA ) * self.failures
+        
+        if ok and latency is not None:
+            self.latency = latency if self.latency is None else ALPHA * latency + ( 1 - ALPHA ) * self.latency
+
+
+    def score( self ) -> float:
+        """
+        Expected seconds per successful fetch, lower is better. Unscored circuits
+        get 0 so they are tried.
+
+        """
+        return ( self.latency or 0.0 ) / max( 0.05, 1.0 - self.failures )
+
+
+    def renew_async( self, incl_countries : str = "", excl_countries : str = "" ) -> threading.Event:
+        """
+        Renews the circuit in the background. Fetches are kept off the circuit until
+        Tor reports a new circuit built. Renewing an already renewing circuit is a no-op.
+
+        Returns:
+            threading.Event: set once the circuit is ready.
+        """
+        with RENEWAL_LOCK:
+            if not self.ready.is_set():
+                return self.ready
+            self.ready.clear()
+
+        def renew():
+            try:
+                if self.renew( incl_countries, excl_countries ):
+                    printl( f"[✓] Circuit { self } renewed." )
+                
+                # New exit, new scores.
+                self.latency, self.failures, self.samples = None, 0.0, 0
+
+            except Exception as e:
+                printl( f"[!] Could not renew { self }: { e }" )
+
+            finally:
+                self.ready.set()
+
+        threading.Thread( target = renew, name = f"renew-{ self.socks_port }", daemon = True ).start()
+        return self.ready
+
+
+    def renew( self, incl_countries : str = "", excl_countries : str = "" ) -> bool:
+        """
+        Renews the exit of this circuit, optionally with exit-node constraints.
+        Blocks until Tor has built a new circuit.
+
+        """
+        if not incl_countries and not excl_countries:
+            return self.session.renew()
+
+        return self.session.set_exit_nodes(
+            country_codes = incl_countries or None,
+            exclude_codes = excl_countries or None,
+        )
+
+
+    def __str__( self ): return f"{ self.proxy } (control { self.control_port })"
+
+
+class CircuitPool:
+    """
+    Assigns forums to circuits and spreads the fetches over them.
+
+    Interface:
+        CircuitPool(circuits)
+            - new pool over the given circuits.
+
+        CircuitPool.acquire(key, fastest=False) -> Circuit
+            - circuit for the next fetch of the forum `key`. Release it after the fetch.
+            - while the forum's circuit is being renewed, another ready circuit is lent out.
+              If none is ready, the forum's own circuit is returned, wait for its `ready`.
+            - with `fastest`, the ready circuit with the best score is used instead.
+
+        CircuitPool.release(circuit, latency=None, ok=True) -> bool
+            - the fetch on the circuit is done, record it. True if the circuit has degraded
+              past the thresholds and should be rotated.
+    """
+
+    def __init__( self, circuits : list[Circuit], max_latency : float = 20.0, max_failures : float = 0.5, cooldown : float = 300 ):
+        self.circuits     : list[Circuit] = circuits or [ Circuit() ]
+        self.max_latency  : float = max_latency  # Seconds of EWMA latency past which a circuit is rotated.
+        self.max_failures : float = max_failures # EWMA failure rate past which a circuit is rotated.
+        self.cooldown     : float = cooldown     # Seconds between preemptive rotations of a circuit.
+        
+        self.rotated : dict[Circuit, float] = {} # Circuit -> time.monotonic() of its last preemptive rotation.
+        self.lock    = threading.Lock()
+
+
+    @classmethod
+    def from_config( cls, config : dict ) -> "CircuitPool":
+        """
+        Builds the pool from the [tor] table of config.toml.
+
+        Expected config format:
+
+            [tor]
+            circuits = [
+                { socks_port = 9050, control_port = 9051 },
+                { socks_port = 9060, control_port = 9061 },
+            ]
+            max_latency  = 20.0   # Optional, see CircuitPool.
+            max_failures = 0.5
+        """
+        sessions : dict[int, ControlSession] = {}
+
+        return cls([
+            Circuit(
+                socks_port   = circuit.get( "socks_port",   9050 ),
+                control_port = circuit.get( "control_port", 9051 ),
+                host         = circuit.get( "host", "127.0.0.1" ),
+                session      = sessions.setdefault( circuit.get( "control_port", 9051 ), ControlSession( circuit.get( "control_port", 9051 ) ) ),
+            )
+            for circuit in config.get( "circuits", [] )
+        ],
+            max_latency  = config.get( "max_latency",  20.0 ),
+            max_failures = config.get( "max_failures", 0.5  ),
+        )
+
+
+    #
+    #   Interface
+    #
+    def acquire( self, key : str, fastest : bool = False ) -> Circuit:
+        with self.lock:
+            circuit = self._assign( key )
+            ready   = [ other for other in self.circuits if other.ready.is_set() ]
+
+            # Time-sensitive forum, take the best scoring ready circuit.
+            if fastest and ready:
+                circuit = min( ready, key = lambda other: ( other.score(), other.active ) )
+
+            # Forum's circuit is renewing, borrow the least busy ready one.
+            elif not circuit.ready.is_set() and ready:
+                circuit = min( ready, key = lambda other: other.active )
+
+            circuit.active += 1
+            return circuit
+
+
+    def release( self, circuit : Circuit, latency : float = None, ok : bool = True ) -> bool:
+        with self.lock:
+            circuit.active -= 1
+            circuit.record( latency, ok )
+            
+            # Slow or flaky, but not necessarily failing. Rotate it before it costs more.
+            if circuit.samples < MIN_SAMPLES or not circuit.ready.is_set():
+                return False
+            
+            if time.monotonic() - self.rotated.get( circuit, float("-inf") ) < self.cooldown:
+                return False
+            
+            if ( circuit.latency or 0.0 ) > self.max_latency or circuit.failures > self.max_failures:
+                self.rotated[circuit] = time.monotonic()
+                return True
+            
+            return False
+
+
+    def __iter__( self ):
+        for circuit in self.circuits:
+            yield circuit
+
+
+    #
+    #   Implementation
+    #
+    def _assign( self, key : str ) -> Circuit:
+        for circuit in self.circuits:
+            if key in circuit.forums:
+                return circuit
+
+        # New forums go to the circuit with the fewest forums, then the fewest fetches in flight.
+        circuit = min( self.circuits, key = lambda circuit: ( len(circuit.forums), circuit.active ) )
+        circuit.forums.add( key )
+        return circuit
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )
@@ -20,13 +20,7 @@ def reset_configuration( port : int = 9051 ):
     """
     with Controller.from_port( port = port ) as controller:
         controller.authenticate()
-        
-        controller.reset_conf("ExitNodes")
-        controller.reset_conf("StrictNodes")
-        controller.reset_conf("ExcludeExitNodes")
-
-        controller.set_conf("CircuitBuildTimeout",      "10")
-        controller.set_conf("LearnCircuitBuildTimeout", "1" )
+        configure_defaults( controller )
 
 
 def set_exit_nodes( country_codes : str, exclude_codes : str = "", port = 9051 ) -> bool:
@@ -45,15 +39,7 @@ def set_exit_nodes( country_codes : str, exclude_codes : str = "", port = 9051 )
     try:
         with Controller.from_port( port = port ) as controller:
             controller.authenticate()
-            
-            # Set Inclusions and Exclusions for the exit nodes
-            controller.set_conf("ExitNodes",        country_codes)
-            controller.set_conf("ExcludeExitNodes", exclude_codes)
-            
-            # Set other required configs 
-            controller.set_conf("StrictNodes",              "1" )
-            controller.set_conf("CircuitBuildTimeout",      "10")
-            controller.set_conf("LearnCircuitBuildTimeout", "1" )
+            configure_exit_nodes( controller, country_codes, exclude_codes )
 
             controller.signal(Signal.NEWNYM)
             time.sleep( controller.get_newnym_wait() )
@@ -94,5 +80,40 @@ def renew_tor_ip( port : int = 9051 ) -> bool:
     
     # Default to False
     return False
- 
-            
\ No newline at end of file
+
+
+#
+#   Configuration, on an authenticated controller
+#
+def configure_defaults( controller : Controller ):
+    """
+    Resets the exit-node constraints of the Torrc configuration.
+    
+    Args:
+        controller (Controller): Authenticated controller of the Tor proxy
+    """
+    controller.reset_conf("ExitNodes")
+    controller.reset_conf("StrictNodes")
+    controller.reset_conf("ExcludeExitNodes")
+
+    controller.set_conf("CircuitBuildTimeout",      "10")
+    controller.set_conf("LearnCircuitBuildTimeout", "1" )
+
+
+def configure_exit_nodes( controller : Controller, country_codes : str, exclude_codes : str = "" ):
+    """
+    Constrains the exit nodes to specific countries. Takes effect on new circuits.
+    
+    Args:
+        controller (Controller): Authenticated controller of the Tor proxy
+        country_codes (str):     Country code selection for Tor exit nodes
+        exclude_codes (str):     Country code exclusions for Tor exit nodes
+    """
+    # Set Inclusions and Exclusions for the exit nodes
+    controller.set_conf("ExitNodes",        country_codes)
+    controller.set_conf("ExcludeExitNodes", exclude_codes)
+    
+    # Set other required configs 
+    controller.set_conf("StrictNodes",              "1" )
+    controller.set_conf("CircuitBuildTimeout",      "10")
+    controller.set_conf("LearnCircuitBuildTimeout", "1" )
@@ -1,7 +1,11 @@
 import time
 from datetime import datetime
 
-from . import handling
+from .circuits import Circuit, CircuitPool
+from .retry    import Breaker, RetryPolicy
+
+import scraper.browser
+from scheduler.budget import FetchBudget
 
 
 class Manager:
@@ -9,21 +13,50 @@ class Manager:
     Tor-circuit management wrapper.
 
     Interface:
-        Manager(max_retries=3, incl_countries="", excl_countries="")
-            - create a new manager with retry limits and optional Tor exit-node constraints.
+        Manager(max_retries=3, incl_countries="", excl_countries="", circuits=None, policy=None, breaker=None, budget=None)
+            - create a new manager with retry limits, optional Tor exit-node constraints,
+              the pool of circuits to use (defaults to a single Tor on 9050/9051), the
+              retry policy, the per-forum breaker (see tor.retry) and the fetch budget
+              shared by all forums (see scheduler.budget, unlimited by default).
 
         Manager.execute_function(func, *args, **kwargs)
-            - execute a function safely with automatic retries.
-            - on failure, renews the Tor circuit (optionally using exit-node filters).
+            - execute a function safely with automatic retries, as the retry policy allows.
+            - on failure, renews the Tor circuits (optionally using exit-node filters) when that can help.
+
+        Manager.circuit_stats() -> dict
+            - live circuits, build times and bandwidth per control port, from Tor's events.
+
+        Manager.fetch(key, func, url, *args, **kwargs)
+            - execute func(url, proxy, *args, **kwargs) over the circuit of the forum `key`.
+            - failures are classified: only those a new circuit can help renew the circuit,
+              in the background, and the retry goes to another ready circuit. With none
+              ready, the fetch is parked until its circuit is ready. Others back off or give up.
+            - forums failing repeatedly are skipped by their breaker for a cooldown.
+            - latency and failures are scored per circuit, circuits degrading past the
+              thresholds are rotated preemptively. Time queued in the browser pool is left out.
+            - every attempt spends one fetch of the budget, waiting for it if spent.
+              `budget=` spends another budget instead, e.g. the backfill's own.
+
+        Manager.prefer_fastest(key)
+            - fetches of the forum `key` go to the best scoring ready circuit.
 
     """
 
-    def __init__( self, max_retries : int = 3, incl_countries : str = "", excl_countries : str = "", ):
+    def __init__( self, max_retries : int = 3, incl_countries : str = "", excl_countries : str = "", circuits : CircuitPool = None, policy : RetryPolicy = None, breaker : Breaker = None, budget : FetchBudget = None ):
         self.max_retries    = max_retries
         self.incl_countries = incl_countries 
         self.excl_countries = excl_countries
+        self.circuits       = circuits or CircuitPool([ Circuit() ])
+        self.policy         = policy   or RetryPolicy( max_retries )
+        self.breaker        = breaker  or Breaker()
+        self.budget         = budget   or FetchBudget()
         
-        self.wait_config_change = 5
+        self.wait_renewal   = 60  # Seconds a parked fetch waits for its circuit at most.
+        self.fastest        : set[str] = set() # Time-sensitive forums.
+        
+        # Long-lived control sessions, one per Tor instance, tracking circuit events from now on.
+        for session in { circuit.session for circuit in self.circuits }:
+            session.start()
         
         # TODO: Validate incl and excl with regex
 
@@ -39,35 +72,123 @@ class Manager:
                 return func(*args, **kwargs)
             
             except Exception as e:
-                printl( f"[!] Ran into an issue." )
-                
-                # Retries exceeded.
                 retry_counter += 1
-                if retry_counter == self.max_retries:
+                decision = self.policy.decide( e, retry_counter )
+                printl( f"[!] Ran into an issue ({ decision.kind }): {e}" )
+                
+                # Retries exceeded, or no retry will help.
+                if not decision.retry:
                     printl( f"[!!!] Could not fix the issue: {e}" )
                     return None 
                 
-                self._handle_errors()
+                if decision.renew:
+                    self._handle_errors()
+                time.sleep( decision.delay )
+    
+    
+    def fetch( self, key : str, func, url : str, *args, budget : FetchBudget = None, **kwargs ):
+        # Forum has failed too often, skip it until its breaker cools down.
+        if not self.breaker.allow( key ):
+            printl( f"[⏸] Skipping { key }, its breaker is open." )
+            return None
+        
+        try:
+            return self._fetch( key, func, url, *args, budget = budget, **kwargs )
+        
+        # A trial fetch without an outcome (e.g. a 404, or parked too long) would keep the breaker open for good.
+        finally:
+            self.breaker.release( key )
+    
                 
+    def prefer_fastest( self, key : str ):
+        self.fastest.add( key )
+    
+    
+    def circuit_stats( self ) -> dict:
+        return { 
+            circuit.control_port : circuit.session.stats() 
+            for circuit in self.circuits 
+        }
+    
+    
     #
     #   Implementation
     #
-    def _handle_errors( self ):
+    def _fetch( self, key : str, func, url : str, *args, budget : FetchBudget = None, **kwargs ):
+        retry_counter = 0
+        while 1:
+            circuit = self.circuits.acquire( key, key in self.fastest )
+            
+            # No circuit ready, park until ours is.
+            if not circuit.ready.is_set():
+                self.circuits.release( circuit )
+                printl( f"[…] Waiting for { circuit } to be renewed." )
+                if not circuit.ready.wait( self.wait_renewal ):
+                    printl( f"[!!!] { circuit } was not renewed in time." )
+                    return None
+                continue
+            
+            # Only attempts that go out are counted.
+            ( budget or self.budget ).acquire()
+            
+            started = time.monotonic()
+            scraper.browser.queued()
+            try: 
+                # Try to run and return Function over the forum's circuit.
+                result = func( url, circuit.proxy, *args, **kwargs )
+                
+                # Time spent queued behind other navigations in the browser pool isn't the circuit's.
+                self._release( circuit, time.monotonic() - started - scraper.browser.queued(), True )
+                self.breaker.success( key )
+                return result
+            
+            except Exception as e:
+                retry_counter += 1
+                decision = self.policy.decide( e, retry_counter )
+                printl( f"[!] Ran into an issue ({ decision.kind }) on { circuit }: {e}" )
+                
+                # Only failures a new circuit could fix count against the circuit.
+                self._release( circuit, None, not decision.renew )
+                error = e
+            
+            # Retries exceeded, or no retry will help.
+            if not decision.retry:
+                printl( f"[!!!] Could not fix the issue: {error}" )
+                if decision.trips and self.breaker.failure( key ):
+                    printl( f"[⏸] { key } keeps failing, skipping it for { self.breaker.cooldown }s." )
+                return None 
+            
+            if decision.renew:
+                self._handle_errors( circuit )
+            time.sleep( decision.delay )
+    
+    
+    def _release( self, circuit : Circuit, latency : float | None, ok : bool ):
+        if not self.circuits.release( circuit, latency, ok ):
+            return
+        
+        printl( f"[!] { circuit } degraded ({ circuit.latency or 0 :.1f}s, { circuit.failures :.0%} failures), rotating it." )
+        circuit.renew_async( self.incl_countries, self.excl_countries )
+    
+    
+    def _handle_errors( self, circuit : Circuit = None ):
         # TODO: Add IP change check?
         printl( f"[!] Renewing the tor circuit to try to fix the issue." )
         
-        # If no special requirements are set, just reset the ip
-        if (self.incl_countries == "") and (self.excl_countries == ""):
-            handling.renew_tor_ip()
-            time.sleep( self.wait_config_change )
+        # A specific circuit is renewed in the background, the retry can go elsewhere meanwhile.
+        # If special requirements are set, they are used in the configuration
+        if circuit:
+            circuit.renew_async( self.incl_countries, self.excl_countries )
             return
         
-        # If special requirements are set, use them in the configuration
-        handling.set_exit_nodes(
-            country_codes = self.incl_countries or None,
-            exclude_codes = self.excl_countries or None
-        )
-        time.sleep( self.wait_config_change )
+        # Without a specific circuit, renew them all and wait for them.
+        renewals = [ 
+            _circuit.renew_async( self.incl_countries, self.excl_countries ) 
+            for _circuit in self.circuits 
+        ]
+        for ready in renewals:
+            ready.wait( self.wait_renewal )
+        
         printl( f"[✓] Circuit should be renewed." )
 
 
@@ -0,0 +1,203 @@
+"""
+*   Retry policy for fetches: which errors are worth retrying, when a new circuit
+*   can help, how long to back off, and when to stop trying a forum altogether.
+"""
+import random, threading, time
+from dataclasses import dataclass
+
+import requests
+from playwright.sync_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeout
+
+from scraper.errors import ChallengeError, HTTPStatusError
+
+
+# Error classes
+NETWORK   = "network"    # Connection failures and timeouts, usually the circuit.
+CHALLENGE = "challenge"  # Anti-bot challenges, a new exit may not get one.
+STATUS    = "status"     # HTTP error statuses.
+CODE      = "code"       # Anything else, a bug a retry won't fix.
+
+
+@dataclass(slots = True)
+class Decision:
+    """
+    What to do after a failed attempt.
+
+    """
+    kind  : str           # One of the error classes.
+    retry : bool          # Whether another attempt can succeed.
+    renew : bool          # Whether a new circuit can help.
+    delay : float = 0.0   # Seconds to back off before the next attempt.
+    trips : bool  = True  # Whether the failure counts towards the forum's breaker.
+
+
+def classify( error : Exception ) -> str:
+    """
+    Sorts an error into one of the error classes.
+
+    """
+    if isinstance( error, ChallengeError ):
+        return CHALLENGE
+
+    if isinstance( error, ( HTTPStatusError, requests.HTTPError ) ):
+        return STATUS
+
+    # Bad urls, no circuit will fix them.
+    if isinstance( error, ( requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema ) ):
+        return CODE
+
+    # Any other requests failure is the transport too, e.g. a connection dropped mid-body (ChunkedEncodingError).
+    if isinstance( error, ( PlaywrightTimeout, requests.RequestException, ConnectionError, TimeoutError ) ):
+        return NETWORK
+
+    # Playwright reports network failures as plain errors, e.g. "net::ERR_SOCKS_CONNECTION_FAILED".
+    if isinstance( error, PlaywrightError ) and "net::" in str( error ):
+        return NETWORK
+
+    return CODE
+
+
+class RetryPolicy:
+    """
+    Decides, per error class, whether and how a failed fetch is retried.
+
+    Network errors and challenges are retried on a new circuit, server errors and
+    rate limits are retried on the same circuit after a back off, client errors
+    (e.g. 404) and code errors are not retried. Back offs grow exponentially with
+    full jitter.
+
+    Interface:
+        RetryPolicy(max_retries=3, base=2.0, cap=60.0)
+
+        RetryPolicy.decide(error, attempt) -> Decision
+            - attempt counts from 1, the attempt that just failed.
+    """
+
+    def __init__( self, max_retries : int = 3, base : float = 2.0, cap : float = 60.0 ):
+        self.max_retries : int   = max_retries
+        self.base        : float = base  # Seconds of back off after the first failure, at most.
+        self.cap         : float = cap   # Seconds of back off at most.
+
+
+    @classmethod
+    def from_config( cls, config : dict, max_retries : int = 3 ) -> "RetryPolicy":
+        return cls(
+            max_retries = config.get( "max_retries",  max_retries ),
+            base        = config.get( "backoff_base", 2.0 ),
+            cap         = config.get( "backoff_cap",  60.0 ),
+        )
+
+
+    def decide( self, error : Exception, attempt : int ) -> Decision:
+        kind     = classify( error )
+        retry    = attempt < self.max_retries
+        decision = Decision( kind = kind, retry = retry, renew = False )
+
+        if kind in ( NETWORK, CHALLENGE ):
+            decision.renew = True
+
+        elif kind == STATUS:
+            status = error.status
+            # Blocked exit, a new one may get through.
+            if status == 403:
+                decision.renew = True
+            # Rate limited or server trouble, wait it out.
+            elif status == 429 or status >= 500:
+                pass
+            # Gone, forbidden or malformed: no retry will fix it, and the forum is still up.
+            else:
+                decision.retry, decision.trips = False, False
+
+        else:
+            decision.retry, decision.trips = False, False
+
+        if decision.retry:
+            decision.delay = random.uniform( 0, min( self.cap, self.base * 2 ** ( attempt - 1 ) ) )
+
+        return decision
+
+
+class Breaker:
+    """
+    Per-forum circuit breaker. After `threshold` failed fetches in a row the forum
+    is skipped for `cooldown` seconds, then a single trial fetch decides whether it
+    is closed again or stays open for another cooldown.
+
+    Interface:
+        Breaker(threshold=5, cooldown=600)
+
+        Breaker.allow(key) -> bool
+            - whether a fetch of the forum `key` may go ahead.
+
+        Breaker.success(key) / Breaker.failure(key)
+            - record the outcome of a fetch.
+
+        Breaker.release(key)
+            - end the calling thread's trial of the forum `key`, if it had no outcome
+              (e.g. a 404, or a fetch parked past its wait). The next fetch is a new trial.
+    """
+
+    def __init__( self, threshold : int = 5, cooldown : float = 600 ):
+        self.threshold : int   = threshold
+        self.cooldown  : float = cooldown
+
+        self.failures  : dict[str, int]   = {}  # Failed fetches in a row, per forum.
+        self.opened    : dict[str, float] = {}  # time.monotonic() the breaker of a forum opened.
+        self.trials    : dict[str, int]   = {}  # Forums on trial -> thread ident of the trial fetch.
+        self.lock      = threading.Lock()
+
+
+    @classmethod
+    def from_config( cls, config : dict ) -> "Breaker":
+        return cls(
+            threshold = config.get( "breaker_threshold", 5 ),
+            cooldown  = config.get( "breaker_cooldown",  600 ),
+        )
+
+
+    def allow( self, key : str ) -> bool:
+        with self.lock:
+            if key not in self.opened:
+                return True
+
+            # Cooled down, let one trial through.
+            if time.monotonic() - self.opened[key] >= self.cooldown and key not in self.trials:
+                self.trials[key] = threading.get_ident()
+                return True
+
+            return False
+
+
+    def success( self, key : str ):
+        with self.lock:
+            self.failures.pop( key, None )
+            self.opened.pop( key, None )
+            self.trials.pop( key, None )
+
+
+    def release( self, key : str ):
+        with self.lock:
+            # Only the trial's own fetch ends it, not others that were already under way.
+            if self.trials.get( key ) == threading.get_ident():
+                self.trials.pop( key )
+
+
+    def failure( self, key : str ) -> bool:
+        """
+        Returns:
+            bool: True if this failure opened the breaker.
+        """
+        with self.lock:
+            self.failures[key] = self.failures.get( key, 0 ) + 1
+
+            # Failed trial, open for another cooldown.
+            if key in self.trials:
+                self.trials.pop( key )
+                self.opened[key] = time.monotonic()
+                return True
+
+            if self.failures[key] >= self.threshold and key not in self.opened:
+                self.opened[key] = time.monotonic()
+                return True
+
+            return False
@@ -0,0 +1,217 @@
+"""
+*   Long-lived Tor control session, with circuit event tracking.
+"""
+import threading, time
+from collections import deque
+from dataclasses import dataclass, replace
+from datetime    import datetime
+
+import stem.connection
+from stem         import CircStatus, Signal, StreamStatus
+from stem.control import Controller, EventType
+
+from . import handling
+
+
+# Global Variables
+BUILD_TIMEOUT = 10    # Seconds to wait for a fresh circuit after NEWNYM. Matches CircuitBuildTimeout.
+BUILD_HISTORY = 100   # Circuit build times kept per session.
+
+
+@dataclass(slots = True)
+class CircuitStats:
+    """
+    Live data of one Tor circuit, from CIRC, CIRC_BW and STREAM events.
+
+    """
+    id       : str
+    status   : str   = None
+    launched : float = None   # time.monotonic() of LAUNCHED
+    build    : float = None   # Seconds from LAUNCHED to BUILT
+    read     : int   = 0      # Bytes read on the circuit
+    written  : int   = 0      # Bytes written on the circuit
+    streams  : int   = 0      # Streams attached to the circuit
+
+
+class ControlSession:
+    """
+    Authenticated stem controller kept open for the lifetime of the Manager.
+
+    Subscribes to CIRC, CIRC_BW, STREAM and BW events so that a renewal can be
+    confirmed by a freshly built circuit, instead of sleeping for a fixed time.
+    The controller is reconnected transparently if Tor drops it.
+
+    Interface:
+        ControlSession(port=9051)
+            - new session, connects lazily.
+
+        ControlSession.start() -> bool
+            - connect and start tracking events now.
+
+        ControlSession.renew(timeout=BUILD_TIMEOUT) -> bool
+            - NEWNYM, then wait until a new circuit is built. False if none was built in time.
+
+        ControlSession.set_exit_nodes(country_codes, exclude_codes) -> bool
+            - constrain the exit nodes and renew.
+
+        ControlSession.reset_configuration()
+            - reset the exit-node constraints.
+
+        ControlSession.stats() -> dict
+            - open circuits, recent build times and the last bandwidth reading.
+
+        ControlSession.close()
+    """
+
+    def __init__( self, port : int = 9051 ):
+        self.port       : int        = port
+        self.controller : Controller = None
+        self.lock       = threading.RLock()
+
+        # Event tracking, guarded by `built`.
+        self.built        = threading.Condition()
+        self.last_built   : float                   = 0     # time.monotonic() of the last BUILT circuit.
+        self.circuits     : dict[str, CircuitStats] = {}
+        self.build_times  : deque                   = deque( maxlen = BUILD_HISTORY )
+        self.bandwidth    : tuple[int, int]         = (0, 0) # Bytes read and written in the last second.
+
+
+    #
+    #   Interface
+    #
+    def start( self ) -> bool:
+        try:
+            with self.lock:
+                self._controller()
+            return True
+
+        except Exception as e:
+            printl( f"[!] Could not connect to the Tor control port { self.port }: { e }" )
+            return False
+
+
+    def renew( self, timeout : float = BUILD_TIMEOUT ) -> bool:
+        try:
+            with self.lock:
+                controller = self._controller()
+
+                # Tor rate limits NEWNYM, a signal sent too early would just be delayed.
+                time.sleep( controller.get_newnym_wait() )
+
+                signalled = time.monotonic()
+                controller.signal( Signal.NEWNYM )
+
+            return self._wait_built( signalled, timeout )
+
+        except stem.connection.UnreadableCookieFile as e:
+            print( f"[{__name__}] stem.connection.UnreadableCookieFile: {e}. Do you have permissions for this action? Hint: sudo." )
+            return False
+
+
+    def set_exit_nodes( self, country_codes : str, exclude_codes : str = "" ) -> bool:
+        try:
+            with self.lock:
+                handling.configure_exit_nodes( self._controller(), country_codes, exclude_codes )
+
+        except stem.connection.UnreadableCookieFile as e:
+            print( f"[{__name__}] stem.connection.UnreadableCookieFile: {e}. Do you have permissions for this action? Hint: sudo." )
+            return False
+
+        return self.renew()
+
+
+    def reset_configuration( self ):
+        with self.lock:
+            handling.configure_defaults( self._controller() )
+
+
+    def stats( self ) -> dict:
+        with self.built:
+            return {
+                "circuits"    : [ replace( circuit ) for circuit in self.circuits.values() ],
+                "build_times" : list( self.build_times ),
+                "bandwidth"   : self.bandwidth,
+            }
+
+
+    def close( self ):
+        with self.lock:
+            if self.controller:
+                self.controller.close()
+            self.controller = None
+
+
+    #
+    #   Implementation
+    #
+    def _controller( self ) -> Controller:
+        if self.controller and self.controller.is_alive():
+            return self.controller
+
+        printl( f"[>] Connecting to the Tor control port { self.port } ..." )
+        controller = Controller.from_port( port = self.port )
+        controller.authenticate()
+
+        controller.add_event_listener( self._on_circuit,   EventType.CIRC    )
+        controller.add_event_listener( self._on_bandwidth, EventType.CIRC_BW )
+        controller.add_event_listener( self._on_stream,    EventType.STREAM  )
+        controller.add_event_listener( self._on_traffic,   EventType.BW      )
+
+        self.controller = controller
+        return controller
+
+
+    def _wait_built( self, since : float, timeout : float ) -> bool:
+        with self.built:
+            if self.built.wait_for( lambda: self.last_built > since, timeout ):
+                return True
+
+        printl( f"[!] No new circuit built on control port { self.port } within { timeout }s." )
+        return False
+
+
+    def _on_circuit( self, event ):
+        with self.built:
+            circuit = self.circuits.setdefault( event.id, CircuitStats( id = event.id ) )
+            circuit.status = event.status
+
+            if event.status == CircStatus.LAUNCHED:
+                circuit.launched = time.monotonic()
+
+            elif event.status == CircStatus.BUILT:
+                self.last_built = time.monotonic()
+                if circuit.launched:
+                    circuit.build = self.last_built - circuit.launched
+                    self.build_times.append( circuit.build )
+                self.built.notify_all()
+
+            elif event.status in ( CircStatus.FAILED, CircStatus.CLOSED ):
+                self.circuits.pop( event.id, None )
+
+
+    def _on_bandwidth( self, event ):
+        with self.built:
+            circuit = self.circuits.get( event.id )
+            if circuit:
+                circuit.read    += event.read
+                circuit.written += event.written
+
+
+    def _on_stream( self, event ):
+        if event.status != StreamStatus.SUCCEEDED:
+            return
+
+        with self.built:
+            circuit = self.circuits.get( event.circ_id )
+            if circuit:
+                circuit.streams += 1
+
+
+    def _on_traffic( self, event ):
+        with self.built:
+            self.bandwidth = ( event.read, event.written )
+
+
+# Helper functions.
+def stamp(): return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def printl( string ): print( f"[{ stamp() }][{ __name__ }]" + string )